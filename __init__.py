@@ -1,18 +1,23 @@
 if __name__ == '__main__':
-	from my_lexer import Lexer
-	from my_parser import Parser
+	from my_cache import ASTCache
+	from my_call_graph import prune
+	from my_evaluator import fold_calls
 	from my_preprocessor import Preprocessor
+	from my_resolver import resolve
 	from compiler.my_compiler import CodeGenerator
 	file = 'test.my'
 	code = open(file).read()
-	lexer = Lexer(code, file)
-	parser = Parser(lexer)
-	t = parser.parse()
-	symtab_builder = Preprocessor(parser.file_name)
-	symtab_builder.check(t)
+	t = ASTCache().parse(code, file)
+	annotations = resolve(t)
+	symtab_builder = Preprocessor(file)
+	symtab_builder.check(t, annotations)
 	if not symtab_builder.warnings:
-		generator = CodeGenerator(parser.file_name)
-		generator.generate_code(t)
+		t, folded = fold_calls(t, annotations, file)
+		t, dead_code = prune(t, annotations)
+		if dead_code:
+			print(dead_code)
+		generator = CodeGenerator(file)
+		generator.generate_code(t, annotations)
 		# generator.evaluate(True, True, False)
 		# generator.evaluate(True, False, False)
 		generator.evaluate(False, True, False)
@@ -1,5 +1,6 @@
 from llvmlite import ir
 from my_grammar import *
+from my_types import BUILTIN_TYPES
 
 
 RET_VAR = 'ret_var'
@@ -7,17 +8,6 @@ RET_VAR = 'ret_var'
 NUM_TYPES = (ir.IntType, ir.DoubleType, ir.FloatType)
 
 # TODO: temorarily making Decimal a DoubleType till find (or make) a better representation
-type_map = {
-	ANY: ir.VoidType(),
-	BOOL: ir.IntType(1),
-	INT: ir.IntType(64),
-	INT8: ir.IntType(8),
-	INT32: ir.IntType(32),
-	INT64: ir.IntType(64),
-	INT128: ir.IntType(128),
-	DEC: ir.DoubleType(),
-	FLOAT: ir.FloatType(),
-	FUNC: ir.FunctionType,
-	VOID: ir.VoidType(),
-	STR: ir.IntType(8).as_pointer,
-}
+type_map = {name: BUILTIN_TYPES.llvm(BUILTIN_TYPES[name]) for name in (ANY, BOOL, INT, INT8, INT32, INT64, INT128, DEC, FLOAT, FUNC)}
+type_map[VOID] = ir.VoidType()
+type_map[STR] = ir.IntType(8).as_pointer
@@ -0,0 +1,200 @@
+from llvmlite import ir
+from llvmlite.ir.values import ArgumentAttributes
+
+# Where a pointer may point: into the stack frame of the function it is in, at what one of the
+# function's parameters points to, by its index, or anywhere else
+LOCAL = 'local'
+ANYWHERE = 'anywhere'
+# LLVM 21 spells nocapture as captures(none), the llvmlite that comes with it only knows the new name
+NOCAPTURE = 'nocapture' if 'nocapture' in ArgumentAttributes._known else 'captures(none)'
+# Casts that give the same pointer back
+POINTER_CASTS = ('bitcast', 'addrspacecast')
+
+
+class Effects(object):
+	# What calling a function may do: the memory it reads and writes, as parameter indexes and ANYWHERE,
+	# the pointer parameters it keeps somewhere that outlives the call, and whether it may unwind
+	__slots__ = ('reads', 'writes', 'captures', 'unwinds')
+
+	def __init__(self, reads=(), writes=(), captures=(), unwinds=False):
+		self.reads = frozenset(reads)
+		self.writes = frozenset(writes)
+		self.captures = frozenset(captures)
+		self.unwinds = unwinds
+
+	def __eq__(self, other):
+		return (self.reads, self.writes, self.captures, self.unwinds) == (other.reads, other.writes, other.captures, other.unwinds)
+
+	def __repr__(self):
+		return '{}(reads={}, writes={}, captures={}, unwinds={})'.format(
+			self.kind, sorted(map(str, self.reads)), sorted(map(str, self.writes)), sorted(self.captures), self.unwinds
+		)
+
+	@property
+	def kind(self):
+		if not self.writes:
+			if not self.reads:
+				return 'readnone'
+			return 'readonly'
+		if ANYWHERE not in self.reads | self.writes:
+			return 'argmemonly'
+		return 'writing'
+
+	def attributes(self):
+		if not self.writes:
+			yield 'readnone' if not self.reads else 'readonly'
+		if (self.reads or self.writes) and ANYWHERE not in self.reads | self.writes:
+			yield 'argmemonly'
+		if not self.unwinds:
+			yield 'nounwind'
+
+
+# The C library functions the runtime is built on. None of them unwind or hold on to a pointer they are
+# given, besides realloc. Input and output count as writing anywhere
+LIBC = {
+	'malloc': Effects(writes=[ANYWHERE]),
+	'realloc': Effects([0, ANYWHERE], [0, ANYWHERE], [0]),
+	'free': Effects(writes=[0, ANYWHERE]),
+	'exit': Effects(writes=[ANYWHERE]),
+	'putchar': Effects(writes=[ANYWHERE]),
+	'getchar': Effects(writes=[ANYWHERE]),
+	'puts': Effects([0, ANYWHERE], [ANYWHERE]),
+	'printf': Effects([0, ANYWHERE], [ANYWHERE]),
+	'scanf': Effects([0, ANYWHERE], [ANYWHERE]),
+}
+# A function nothing is known about
+UNKNOWN = None
+
+
+def function_effects(func, summaries):
+	# The Effects of func's body, calls costing what summaries has for the function called
+	origins = {}
+	for index, arg in enumerate(func.args):
+		origins[arg] = frozenset([index])
+	instructions = [instr for block in func.blocks for instr in block.instructions]
+	# An alloca whose address is only loaded from and stored to directly is followed: loading from it
+	# gives back what was stored in it. The codegen keeps every parameter in one of those
+	followed = {instr: frozenset() for instr in instructions if isinstance(instr, ir.AllocaInstr)}
+	for instr in instructions:
+		for position, operand in enumerate(instr.operands):
+			if operand in followed and not (isinstance(instr, (ir.LoadInstr, ir.StoreInstr)) and position == len(instr.operands) - 1):
+				del followed[operand]
+
+	def origin(value):
+		found = origins.get(value)
+		return frozenset([ANYWHERE]) if found is None else found
+
+	changed = True
+	while changed:
+		changed = False
+		for instr in instructions:
+			if isinstance(instr, ir.StoreInstr):
+				value, pointer = instr.operands
+				if pointer in followed and not origin(value) <= followed[pointer]:
+					followed[pointer] |= origin(value)
+					changed = True
+				continue
+			if isinstance(instr, ir.AllocaInstr):
+				found = frozenset([LOCAL])
+			elif isinstance(instr, ir.GEPInstr) or isinstance(instr, ir.CastInstr) and instr.opname in POINTER_CASTS:
+				found = origin(instr.operands[0])
+			elif isinstance(instr, ir.LoadInstr) and instr.operands[0] in followed:
+				found = followed[instr.operands[0]]
+			elif isinstance(instr, (ir.PhiInstr, ir.SelectInstr)):
+				incoming = instr.incomings if isinstance(instr, ir.PhiInstr) else [(instr.lhs, None), (instr.rhs, None)]
+				found = frozenset().union(*(origin(value) for value, _ in incoming))
+			else:
+				continue
+			if origins.get(instr) != found:
+				origins[instr] = found
+				changed = True
+
+	def pointed_at(value):
+		# The memory value points to that is not the function's own stack frame
+		return origin(value) - {LOCAL}
+
+	def parameters(value):
+		if not isinstance(value.type, ir.PointerType):
+			return set()
+		return {found for found in origin(value) if type(found) is int}
+
+	reads = set()
+	writes = set()
+	captures = set()
+	unwinds = False
+	for instr in instructions:
+		if isinstance(instr, ir.LoadInstr):
+			reads |= pointed_at(instr.operands[0])
+		elif isinstance(instr, ir.StoreInstr):
+			value, pointer = instr.operands
+			writes |= pointed_at(pointer)
+			if pointer not in followed:
+				captures |= parameters(value)
+		elif isinstance(instr, ir.CallInstr):
+			callee = summaries.get(instr.callee.name, UNKNOWN) if isinstance(instr.callee, ir.Function) else UNKNOWN
+			if callee is UNKNOWN:
+				reads.add(ANYWHERE)
+				writes.add(ANYWHERE)
+				unwinds = True
+				for arg in instr.args:
+					captures |= parameters(arg)
+				continue
+			for effects, found in ((callee.reads, reads), (callee.writes, writes)):
+				for target in effects:
+					if target == ANYWHERE:
+						found.add(ANYWHERE)
+					elif target < len(instr.args):
+						found |= pointed_at(instr.args[target])
+			for index in callee.captures:
+				if index < len(instr.args):
+					captures |= parameters(instr.args[index])
+			unwinds = unwinds or callee.unwinds
+		elif isinstance(instr, (ir.InvokeInstr, ir.Resume)):
+			return Effects([ANYWHERE], [ANYWHERE], range(len(func.args)), True)
+		elif not isinstance(instr, (ir.GEPInstr, ir.PhiInstr, ir.SelectInstr)) and not (isinstance(instr, ir.CastInstr) and instr.opname in POINTER_CASTS):
+			# Anything else done with a pointer, returning it, comparing it or turning it into an Int, may
+			# let it outlive the call
+			for operand in instr.operands:
+				captures |= parameters(operand)
+	return Effects(reads, writes, captures, unwinds)
+
+
+def infer_effects(module):
+	# The Effects of every function in module. Calls inside a cycle of functions start out costing
+	# nothing and are worked out again until none of them change
+	summaries = {}
+	defined = []
+	for func in module.functions:
+		if func.is_declaration:
+			summaries[func.name] = LIBC.get(func.name, UNKNOWN)
+		else:
+			summaries[func.name] = Effects()
+			defined.append(func)
+	changed = True
+	while changed:
+		changed = False
+		for func in defined:
+			effects = function_effects(func, summaries)
+			if effects != summaries[func.name]:
+				summaries[func.name] = effects
+				changed = True
+	return summaries
+
+
+def add_function_attributes(compiler):
+	# Lets LLVM hoist, combine and drop calls: each function gets what it does to memory and nounwind,
+	# and its pointer parameters nocapture. The Dynamic_Array a function is given is also noalias when
+	# it is its only pointer parameter and it is not kept, nothing else reaches it while the call runs
+	dyn_array_ptr = compiler.search_scopes('Dynamic_Array').as_pointer()
+	for name, effects in infer_effects(compiler.module).items():
+		if effects is UNKNOWN:
+			continue
+		func = compiler.module.get_global(name)
+		for attribute in effects.attributes():
+			func.attributes.add(attribute)
+		pointers = [arg for arg in func.args if isinstance(arg.type, ir.PointerType)]
+		for index, arg in enumerate(func.args):
+			if arg in pointers and index not in effects.captures:
+				arg.add_attribute(NOCAPTURE)
+				if arg.type == dyn_array_ptr and len(pointers) == 1:
+					arg.add_attribute('noalias')
@@ -8,6 +8,7 @@ from llvmlite import ir
 from compiler import RET_VAR
 from compiler import type_map
 from compiler.builtin_functions import define_dynamic_array
+from compiler.effects import add_function_attributes
 from compiler.operations import operations
 from my_ast import DotAccess
 from my_ast import Input
@@ -15,6 +16,8 @@ from my_ast import StructLiteral
 from my_ast import CollectionAccess
 from my_ast import VarDecl
 from my_grammar import *
+from my_resolver import resolve
+from my_types import BUILTIN_TYPES
 from my_visitor import NodeVisitor
 
 
@@ -46,40 +49,53 @@ class CodeGenerator(NodeVisitor):
 	def __str__(self):
 		return str(self.module)
 
+	def type_of(self, node, value):
+		# The type the checker gave node. What the IR type of its value stands for is only used when the
+		# checker has nothing more for it than Any, or did not see it
+		typ = self.types.get(node)
+		if BUILTIN_TYPES.is_known(typ):
+			return typ
+		return BUILTIN_TYPES.from_llvm(value.type)
+
 	def visit_program(self, node):
-		self.visit(node.block)
+		self.new_scope(self.layouts.get(node, ()))
+		yield node.block
+		self.end_main()
+
+	def end_main(self):
 		self.branch(self.exit_blocks[0])
 		self.position_at_end(self.exit_blocks[0])
 		self.builder.ret_void()
+		add_function_attributes(self)
 
 	@staticmethod
 	def visit_num(node):
 		return ir.Constant(type_map[node.val_type], node.value)
 
 	def visit_var(self, node):
-		var = self.search_scopes(node.value)
+		var = self.lookup(node.value, self.resolution.get(node))
 		if isinstance(var, type_map[FUNC]):
 			return var
-		return self.load(node.value)
+		return self.load(var)
 
 	def visit_binop(self, node):
 		return operations(self, node)
 
 	def visit_anonymousfunc(self, node):
 		self.anon_counter += 1
-		return self.funcdecl('anon{}'.format(self.anon_counter), node)
+		return (yield from self.funcdecl('anon{}'.format(self.anon_counter), node))
 
 	def visit_funcdecl(self, node):
-		self.funcdecl(node.name, node)
+		yield from self.funcdecl(node.name, node)
 
 	def funcdecl(self, name, node):
-		self.start_function(name, node.return_type, node.parameters, node.parameter_defaults, node.varargs)
+		self.start_function(name, node.return_type, node.parameters, node.parameter_defaults, node.varargs, self.layouts.get(node, ()))
 		for i, arg in enumerate(self.current_function.args):
 			arg.name = list(node.parameters.keys())[i]
 			self.alloc_define_store(arg, arg.name, arg.type)
 		if self.current_function.function_type.return_type != type_map[VOID]:
 			self.alloc_and_define(RET_VAR, self.current_function.function_type.return_type)
-		ret = self.visit(node.body)
+		ret = yield node.body
 		self.end_function(ret)
 
 	def visit_return(self, node):
@@ -90,12 +106,11 @@ class CodeGenerator(NodeVisitor):
 		return True
 
 	def visit_funccall(self, node):
-		func_type = self.search_scopes(node.name)
+		func_type = self.lookup(node.name, self.resolution.get(node))
 		# func_type = self.func_table[node.name]
 		if isinstance(func_type, ir.Function):
+			name = func_type.name
 			func_type = func_type.type.pointee
-			name = self.search_scopes(node.name)
-			name = name.name
 		else:
 			name = node.name
 		if len(node.arguments) < len(func_type.args):
@@ -121,7 +136,7 @@ class CodeGenerator(NodeVisitor):
 	def visit_compound(self, node):
 		ret = None
 		for child in node.children:
-			temp = self.visit(child)
+			temp = yield child
 			if temp:
 				ret = temp
 		return ret
@@ -163,7 +178,7 @@ class CodeGenerator(NodeVisitor):
 			cond_val = self.visit(comp)
 			self.cbranch(cond_val, if_true_block, if_false_block)
 			self.position_at_end(if_true_block)
-			ret = self.visit(node.blocks[x])
+			ret = yield node.blocks[x]
 			if not ret:
 				self.branch(end_block)
 			self.position_at_end(if_false_block)
@@ -183,7 +198,7 @@ class CodeGenerator(NodeVisitor):
 		cond = self.visit(node.comp)
 		self.cbranch(cond, body_block, end_block)
 		self.position_at_end(body_block)
-		self.visit(node.block)
+		yield node.block
 		if not self.is_break:
 			self.branch(cond_block)
 		else:
@@ -231,7 +246,7 @@ class CodeGenerator(NodeVisitor):
 		self.position_at_end(body_block)
 		self.store(self.call('dyn_array_get', [iterator, self.load(position)]), varname)
 		self.store(self.builder.add(one, self.load(position)), position)
-		self.visit(node.block)
+		yield node.block
 		if not self.is_break:
 			self.branch(cond_block)
 		else:
@@ -243,7 +258,7 @@ class CodeGenerator(NodeVisitor):
 
 	def visit_loopblock(self, node):
 		for child in node.children:
-			temp = self.visit(child)
+			temp = yield child
 			if temp:
 				return temp
 
@@ -264,7 +279,7 @@ class CodeGenerator(NodeVisitor):
 			self.branch(switch_end_block)
 		for x, case in enumerate(node.cases):
 			self.position_at_end(cases[x])
-			break_ = self.visit(case.block)
+			break_ = yield case.block
 			if break_ == BREAK:
 				self.branch(switch_end_block)
 			else:
@@ -320,8 +335,6 @@ class CodeGenerator(NodeVisitor):
 				return
 			if isinstance(node.left, VarDecl):
 				var_name = node.left.value.value
-				if node.left.type.value == FLOAT:
-					node.right.value = float(node.right.value)
 				self.alloc_define_store(var, var_name, var.type)
 			elif isinstance(node.left, DotAccess):
 				obj = self.search_scopes(node.left.obj)
@@ -335,11 +348,9 @@ class CodeGenerator(NodeVisitor):
 				self.call('dyn_array_set', [self.search_scopes(node.left.collection.value), self.const(node.left.key.value), right])
 			else:
 				var_name = node.left.value
-				var_value = self.top_scope.get(var_name)
+				var_value = self.top_scope.get(var_name, slot=self.slot_of(node))
 				if var_value:
-					if isinstance(var_value, float):
-						node.right.value = float(node.right.value)
-					self.store(var, var_name)
+					self.store(var, var_value)
 				elif isinstance(var, ir.Function):
 					self.define(var_name, var)
 				else:
@@ -375,13 +386,11 @@ class CodeGenerator(NodeVisitor):
 			var_name = self.search_scopes(node.left.collection.value)
 			key = self.const(node.left.key.value)
 			var = self.call('dyn_array_get', [var_name, key])
-			pointee = var.type
 		else:
 			var_name = node.left.value
 			var = self.load(var_name)
-			pointee = self.search_scopes(var_name).type.pointee
 		op = node.op
-		if isinstance(pointee, ir.IntType):
+		if BUILTIN_TYPES.is_integer(self.type_of(node.left, var)):
 			if op == PLUS_ASSIGN:
 				res = self.builder.add(var, right)
 			elif op == MINUS_ASSIGN:
@@ -487,9 +496,9 @@ class CodeGenerator(NodeVisitor):
 		else:
 			self.call('putchar', [ir.Constant(type_map[INT32], 10)])
 			return
-		if isinstance(val.type, ir.IntType):
-			# noinspection PyUnresolvedReferences
-			if val.type.width == 1:
+		typ = self.type_of(node.value, val)
+		if BUILTIN_TYPES.is_integer(typ):
+			if typ.name == BOOL:
 				array = self.create_array()
 				self.call('bool_to_str', [array, val])
 				val = array
@@ -497,7 +506,7 @@ class CodeGenerator(NodeVisitor):
 				array = self.create_array()
 				self.call('int_to_str', [array, val])
 				val = array
-		elif isinstance(val.type, (ir.FloatType, ir.DoubleType)):
+		elif BUILTIN_TYPES.is_real(typ):
 			percent_g = self.stringz('%g')
 			percent_g = self.alloc_and_store(percent_g, ir.ArrayType(percent_g.type.element, percent_g.type.count))
 			percent_g = self.gep(percent_g, [self.const(0), self.const(0)])
@@ -530,10 +539,22 @@ class CodeGenerator(NodeVisitor):
 		return self.call('scanf', [percent_ptr_gep, self.allocate(type_map[INT])])
 
 	# noinspection PyUnusedLocal
-	def start_function(self, name, return_type, parameters, parameter_defaults=None, varargs=None):
+	def start_function(self, name, return_type, parameters, parameter_defaults=None, varargs=None, layout=()):
 		self.function_stack.append(self.current_function)
 		self.block_stack.append(self.builder.block)
-		self.new_scope()
+		self.new_scope(layout)
+		func = self.declare_function(name, return_type, parameters, parameter_defaults)
+		self.define(name, func, 1)
+		self.current_function = func
+		entry = self.add_block('entry')
+		self.exit_blocks.append(self.add_block('exit'))
+		self.position_at_end(entry)
+
+	def declare_function(self, name, return_type, parameters, parameter_defaults=None):
+		func = self.module.globals.get(name)
+		if isinstance(func, ir.Function) and func.is_declaration:
+			# declared ahead of its body, the pipeline does this for forward references
+			return func
 		ret_type = type_map[return_type.value]
 		args = [type_map[param.value] for param in parameters.values()]
 		arg_keys = parameters.keys()
@@ -543,12 +564,7 @@ class CodeGenerator(NodeVisitor):
 		func_type.arg_order = arg_keys
 		if hasattr(return_type, 'func_ret_type') and return_type.func_ret_type:
 			func_type.return_type = func_type.return_type(type_map[return_type.func_ret_type.value], [return_type.func_ret_type.value]).as_pointer()
-		func = ir.Function(self.module, func_type, name)
-		self.define(name, func, 1)
-		self.current_function = func
-		entry = self.add_block('entry')
-		self.exit_blocks.append(self.add_block('exit'))
-		self.position_at_end(entry)
+		return ir.Function(self.module, func_type, name)
 
 	def end_function(self, returned=False):
 		if not returned:
@@ -688,7 +704,8 @@ class CodeGenerator(NodeVisitor):
 		buf[:-1] = string.encode('utf-8')
 		return ir.Constant(ir.ArrayType(type_map[INT8], n), buf)
 
-	def generate_code(self, node):
+	def generate_code(self, node, annotations=None):
+		self.use(resolve(node) if annotations is None else annotations)
 		return self.visit(node)
 
 	def evaluate(self, optimize=True, ir_dump=False, only_main=False):
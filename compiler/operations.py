@@ -1,7 +1,8 @@
 from llvmlite import ir
 from compiler import type_map
-from compiler import NUM_TYPES
+from my_ast import Num
 from my_grammar import *
+from my_types import BUILTIN_TYPES
 
 I1 = 'i1'
 I8 = 'i8'
@@ -18,13 +19,17 @@ def operations(compiler, node):
 	right = compiler.visit(node.right)
 	if op == CAST:
 		return cast_ops(compiler, left, right, node)
-	elif isinstance(left.type, ir.IntType) and isinstance(right.type, ir.IntType):
+	result = BUILTIN_TYPES.promote(compiler.type_of(node.left, left), compiler.type_of(node.right, right))
+	if result is not None and left.type != right.type:
+		# The checker let the two through but their values are not the same width, both sides are brought
+		# to the type the operation is done in
+		result = BUILTIN_TYPES.promote(BUILTIN_TYPES.from_llvm(left.type), BUILTIN_TYPES.from_llvm(right.type))
+		if result is not None:
+			left = promote(compiler, left, result)
+			right = promote(compiler, right, result)
+	if BUILTIN_TYPES.is_integer(result):
 		return int_ops(compiler, op, left, right, node)
-	elif type(left.type) in NUM_TYPES and type(right.type) in NUM_TYPES:
-		# if isinstance(left.type, ir.IntType):
-		# 	left = compiler.builder.uitofp(left, type_map[DEC])
-		# if isinstance(right.type, ir.IntType):
-		# 	right = compiler.builder.uitofp(right, type_map[DEC])
+	elif BUILTIN_TYPES.is_real(result):
 		return float_ops(compiler, op, left, right, node)
 	elif isinstance(left, (ir.LoadInstr, ir.GEPInstr)) and isinstance(right, (ir.LoadInstr, ir.GEPInstr)):
 		new_left = compiler.search_scopes(node.left.value)
@@ -32,6 +37,23 @@ def operations(compiler, node):
 		return str_ops(compiler, op, new_left, new_right, node)
 
 
+def promote(compiler, value, typ):
+	target = BUILTIN_TYPES.llvm(typ)
+	if value.type == target:
+		return value
+	if isinstance(value.type, ir.IntType):
+		if isinstance(target, ir.IntType):
+			if value.type.width == 1:
+				return compiler.builder.zext(value, target)
+			return compiler.builder.sext(value, target)
+		if value.type.width == 1:
+			return compiler.builder.uitofp(value, target)
+		return compiler.builder.sitofp(value, target)
+	if isinstance(target, ir.DoubleType):
+		return compiler.builder.fpext(value, target)
+	return compiler.builder.fptrunc(value, target)
+
+
 def int_ops(compiler, op, left, right, node):
 	# if left.type.width == 1:
 	# 	left = compiler.builder.zext(left, type_map[INT])
@@ -51,6 +73,8 @@ def int_ops(compiler, op, left, right, node):
 	elif op == MOD:
 		return compiler.builder.srem(left, right, 'modtmp')
 	elif op == POWER:
+		if not literal_exponent(node):
+			return int_power(compiler, left, right)
 		temp = compiler.builder.alloca(type_map[INT])
 		compiler.builder.store(left, temp)
 		for _ in range(node.right.value - 1):
@@ -76,6 +100,43 @@ def int_ops(compiler, op, left, right, node):
 		raise SyntaxError('Unknown binary operator', node.op)
 
 
+def literal_exponent(node):
+	# ** is right associative, an exponent that is not an Int literal is only known at run time
+	return isinstance(node.right, Num) and type(node.right.value) is int
+
+
+def int_power(compiler, base, exponent):
+	# base ** exponent by squaring, a negative exponent gives 1
+	builder = compiler.builder
+	start_block = builder.block
+	cond_block = compiler.add_block('pow.cond')
+	body_block = compiler.add_block('pow.body')
+	end_block = compiler.add_block('pow.end')
+	compiler.branch(cond_block)
+
+	compiler.position_at_end(cond_block)
+	result = builder.phi(base.type, 'powresult')
+	square = builder.phi(base.type, 'powsquare')
+	remaining = builder.phi(exponent.type, 'powexponent')
+	compiler.cbranch(builder.icmp_signed(GREATER_THAN, remaining, ir.Constant(exponent.type, 0)), body_block, end_block)
+
+	compiler.position_at_end(body_block)
+	odd = builder.trunc(remaining, ir.IntType(1))
+	next_result = builder.select(odd, builder.mul(result, square), result)
+	next_square = builder.mul(square, square)
+	next_remaining = builder.ashr(remaining, ir.Constant(exponent.type, 1))
+	compiler.branch(cond_block)
+
+	result.add_incoming(ir.Constant(base.type, 1), start_block)
+	result.add_incoming(next_result, body_block)
+	square.add_incoming(base, start_block)
+	square.add_incoming(next_square, body_block)
+	remaining.add_incoming(exponent, start_block)
+	remaining.add_incoming(next_remaining, body_block)
+	compiler.position_at_end(end_block)
+	return result
+
+
 def float_ops(compiler, op, left, right, node):
 	if op == PLUS:
 		return compiler.builder.fadd(left, right, 'faddtmp')
@@ -91,6 +152,8 @@ def float_ops(compiler, op, left, right, node):
 	elif op == MOD:
 		return compiler.builder.frem(left, right, 'fmodtmp')
 	elif op == POWER:
+		if not literal_exponent(node):
+			return compiler.builder.call(compiler.module.declare_intrinsic('llvm.pow', [left.type]), [left, right], 'fpowtmp')
 		temp = compiler.builder.alloca(type_map[DEC])
 		compiler.builder.store(left, temp)
 		for _ in range(node.right.value - 1):
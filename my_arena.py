@@ -0,0 +1,198 @@
+from array import array
+from collections import OrderedDict
+import my_ast
+from my_ast import AST
+
+NODE_CLASSES = tuple(cls for cls in vars(my_ast).values() if isinstance(cls, type) and issubclass(cls, AST) and cls is not AST)
+KIND_CODES = {cls: code for code, cls in enumerate(NODE_CLASSES)}
+
+# A field holds one code: the low bits say what it is, the rest where to find it
+TAG_BITS = 3
+TAG_MASK = (1 << TAG_BITS) - 1
+NODE, VALUE, LIST, TUPLE, DICT, ORDERED_DICT = range(6)
+MISSING = -1
+SEQUENCE_TAGS = {list: LIST, tuple: TUPLE, dict: DICT, OrderedDict: ORDERED_DICT}
+
+
+class Arena(object):
+	def __init__(self):
+		self.kinds = array('B')
+		self.starts = array('I')
+		self.fields = array('i')
+		self.values = []
+		self._value_codes = {}
+		# Lists, tuples and dicts already decoded, by the position of the field holding them
+		self._containers = {}
+
+	def __len__(self):
+		return len(self.kinds)
+
+	@classmethod
+	def from_tree(cls, tree):
+		arena = cls()
+		arena.add(tree)
+		return arena
+
+	def add(self, node):
+		pending = []
+		code = self.encode(node, pending)
+		self.fill(pending)
+		return code >> TAG_BITS
+
+	def fill(self, pending):
+		# Nodes get their index when first seen and their fields once popped, which keeps deep trees off the call stack
+		while pending:
+			index, node = pending.pop()
+			fields = self.fields
+			start = len(fields)
+			self.starts[index] = start
+			names = node._fields
+			fields.extend([MISSING] * len(names))
+			for offset, name in enumerate(names):
+				try:
+					value = getattr(node, name)
+				except AttributeError:
+					continue
+				fields[start + offset] = self.encode(value, pending)
+
+	def reserve(self, node):
+		self.kinds.append(KIND_CODES[type(node)])
+		self.starts.append(0)
+		return len(self.kinds) - 1
+
+	def encode(self, value, pending):
+		if isinstance(value, NodeView) and value.arena is self:
+			return value.index << TAG_BITS | NODE
+		if isinstance(value, AST):
+			index = self.reserve(value)
+			pending.append((index, value))
+			return index << TAG_BITS | NODE
+		tag = SEQUENCE_TAGS.get(type(value))
+		if tag is None:
+			return self.value_code(value) << TAG_BITS | VALUE
+		# A sequence is its length followed by its items, dicts store keys and values alternately
+		items = value if tag < DICT else [item for pair in value.items() for item in pair]
+		fields = self.fields
+		start = len(fields)
+		fields.append(len(items))
+		fields.extend([MISSING] * len(items))
+		for offset, item in enumerate(items, start + 1):
+			fields[offset] = self.encode(item, pending)
+		return start << TAG_BITS | tag
+
+	def value_code(self, value):
+		if value is None or type(value) in (str, bool):
+			code = self._value_codes.get(value)
+			if code is None:
+				code = self._value_codes[value] = len(self.values)
+				self.values.append(value)
+			return code
+		self.values.append(value)
+		return len(self.values) - 1
+
+	def decode(self, code):
+		position = code >> TAG_BITS
+		tag = code & TAG_MASK
+		if tag == NODE:
+			return self.node(position)
+		if tag == VALUE:
+			return self.values[position]
+		fields = self.fields
+		items = [self.decode(fields[offset]) for offset in range(position + 1, position + 1 + fields[position])]
+		if tag == LIST:
+			return items
+		if tag == TUPLE:
+			return tuple(items)
+		pairs = zip(items[::2], items[1::2])
+		return dict(pairs) if tag == DICT else OrderedDict(pairs)
+
+	def node(self, index):
+		return VIEW_CLASSES[self.kinds[index]](self, index)
+
+	def tree(self):
+		return self.node(0)
+
+	def get_field(self, index, offset):
+		# A container is decoded once and that same object is the field's value from then on, so changes
+		# made to it are kept
+		position = self.starts[index] + offset
+		found = self._containers.get(position)
+		if found is not None:
+			return found
+		code = self.fields[position]
+		if code == MISSING:
+			raise AttributeError(NODE_CLASSES[self.kinds[index]]._fields[offset])
+		value = self.decode(code)
+		if code & TAG_MASK > VALUE:
+			self._containers[position] = value
+		return value
+
+	def set_field(self, index, offset, value):
+		pending = []
+		position = self.starts[index] + offset
+		self._containers.pop(position, None)
+		self.fields[position] = self.encode(value, pending)
+		self.fill(pending)
+
+
+class NodeView(object):
+	# Stands in for an AST node stored in an Arena. Each node class gets a view class of the same
+	# name, so visitors dispatch and isinstance checks the same way they do for the real nodes
+	__slots__ = ()
+
+	def __init__(self, arena, index):
+		self.arena = arena
+		self.index = index
+
+	def __eq__(self, other):
+		return isinstance(other, NodeView) and self.arena is other.arena and self.index == other.index
+
+	def __hash__(self):
+		return hash((id(self.arena), self.index))
+
+
+def field_property(offset):
+	def getter(view):
+		return view.arena.get_field(view.index, offset)
+
+	def setter(view, value):
+		view.arena.set_field(view.index, offset, value)
+
+	return property(getter, setter)
+
+
+def view_class(cls):
+	namespace = {'__slots__': ('arena', 'index'), '__module__': __name__}
+	for offset, name in enumerate(cls._fields):
+		namespace[name] = field_property(offset)
+	view = type(cls.__name__, (NodeView, cls), namespace)
+	# arena and index are how a view finds its node, not fields of it
+	view._fields = cls._fields
+	return view
+
+
+VIEW_CLASSES = tuple(view_class(cls) for cls in NODE_CLASSES)
+
+
+if __name__ == '__main__':
+	import gc
+	import sys
+	import tracemalloc
+	from my_lexer import Lexer
+	from my_parser import Parser
+	from my_ast import walk
+	file = 'test.my'
+	code = open(file).read()
+	for repeat in (1, 300):
+		tracemalloc.start()
+		tree = Parser(Lexer(code * repeat, file)).parse()
+		gc.collect()
+		tree_size = tracemalloc.get_traced_memory()[0]
+		arena = Arena.from_tree(tree)
+		del tree
+		gc.collect()
+		arena_size = tracemalloc.get_traced_memory()[0]
+		tracemalloc.stop()
+		print('nodes', len(arena), 'tree bytes/node', tree_size // len(arena), 'arena bytes/node', arena_size // len(arena))
+	print(str(arena.tree()) == str(Parser(Lexer(code * repeat, file)).parse()))
+	print('view size', sys.getsizeof(arena.tree().block), 'nodes walked', sum(1 for _ in walk(arena.tree())))
@@ -2,13 +2,22 @@ from my_grammar import *
 
 
 class AST(object):
+	__slots__ = ()
+	_fields = ()
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls._fields = tuple(sorted(set(cls._fields).union(cls.__dict__.get('__slots__', ()))))
+
 	def __str__(self):
-		return '(' + ' '.join(str(value) for key, value in sorted(self.__dict__.items()) if not key.startswith("__") and key != 'read_only' and key != 'line_num' and value is not None) + ')'
+		return '(' + ' '.join(str(value) for key, value in iter_fields(self) if key != 'read_only' and key != 'line_num' and value is not None) + ')'
 
 	__repr__ = __str__
 
 
 class Program(AST):
+	__slots__ = ('block',)
+
 	def __init__(self, block):
 		self.block = block
 
@@ -19,6 +28,8 @@ class Program(AST):
 
 
 class VarDecl(AST):
+	__slots__ = ('value', 'type', 'read_only', 'line_num')
+
 	def __init__(self, value, type_node, line_num, read_only=False):
 		self.value = value
 		self.type = type_node
@@ -27,18 +38,22 @@ class VarDecl(AST):
 
 
 class Var(AST):
+	__slots__ = ('value', 'read_only', 'line_num')
+
 	def __init__(self, value, line_num, read_only=False):
 		self.value = value
 		self.read_only = read_only
 		self.line_num = line_num
 
 	def __str__(self):
-		return ' '.join(str(value) for key, value in sorted(self.__dict__.items()) if not key.startswith("__") and key != 'read_only' and key != 'line_num')
+		return ' '.join(str(value) for key, value in iter_fields(self) if key != 'read_only' and key != 'line_num')
 
 	__repr__ = __str__
 
 
 class Compound(AST):
+	__slots__ = ('children',)
+
 	def __init__(self):
 		self.children = []
 
@@ -49,6 +64,8 @@ class Compound(AST):
 
 
 class FuncDecl(AST):
+	__slots__ = ('name', 'return_type', 'parameters', 'parameter_defaults', 'varargs', 'body', 'line_num', 'args', '_scope')
+
 	def __init__(self, name, return_type, parameters, body, line_num, parameter_defaults=None, varargs=None):
 		self.name = name
 		self.return_type = return_type
@@ -65,6 +82,8 @@ class FuncDecl(AST):
 
 
 class AnonymousFunc(AST):
+	__slots__ = ('return_type', 'parameters', 'parameter_defaults', 'varargs', 'body', 'line_num', 'args', '_scope')
+
 	def __init__(self, return_type, parameters, body, line_num, parameter_defaults=None, varargs=None):
 		self.return_type = return_type
 		self.parameters = parameters
@@ -80,6 +99,8 @@ class AnonymousFunc(AST):
 
 
 class FuncCall(AST):
+	__slots__ = ('name', 'arguments', 'named_arguments', 'line_num')
+
 	def __init__(self, name, arguments, line_num, named_arguments=None):
 		self.name = name
 		self.arguments = arguments
@@ -88,6 +109,8 @@ class FuncCall(AST):
 
 
 class MethodCall(AST):
+	__slots__ = ('obj', 'name', 'arguments', 'named_arguments', 'line_num')
+
 	def __init__(self, obj, name, arguments, line_num, named_arguments=None):
 		self.obj = obj
 		self.name = name
@@ -97,12 +120,16 @@ class MethodCall(AST):
 
 
 class Return(AST):
+	__slots__ = ('value', 'line_num')
+
 	def __init__(self, value, line_num):
 		self.value = value
 		self.line_num = line_num
 
 
 class StructDeclaration(AST):
+	__slots__ = ('name', 'fields', 'line_num')
+
 	def __init__(self, name, fields, line_num):
 		self.name = name
 		self.fields = fields
@@ -110,12 +137,16 @@ class StructDeclaration(AST):
 
 
 class StructLiteral(AST):
+	__slots__ = ('fields', 'line_num')
+
 	def __init__(self, fields, line_num):
 		self.fields = fields
 		self.line_num = line_num
 
 
 class ClassDeclaration(AST):
+	__slots__ = ('name', 'constructor', 'base', 'methods', 'class_fields', 'instance_fields')
+
 	def __init__(self, name, base=None, constructor=None, methods=None, class_fields=None, instance_fields=None):
 		self.name = name
 		self.constructor = constructor
@@ -126,6 +157,8 @@ class ClassDeclaration(AST):
 
 
 class Assign(AST):
+	__slots__ = ('left', 'op', 'right', 'line_num')
+
 	def __init__(self, left, op, right, line_num):
 		self.left = left
 		self.op = op
@@ -134,6 +167,8 @@ class Assign(AST):
 
 
 class OpAssign(AST):
+	__slots__ = ('left', 'op', 'right', 'line_num')
+
 	def __init__(self, left, op, right, line_num):
 		self.left = left
 		self.op = op
@@ -142,6 +177,8 @@ class OpAssign(AST):
 
 
 class If(AST):
+	__slots__ = ('op', 'comps', 'blocks', 'indent_level', 'line_num')
+
 	def __init__(self, op, comps, blocks, indent_level, line_num):
 		self.op = op
 		self.comps = comps
@@ -151,10 +188,12 @@ class If(AST):
 
 
 class Else(AST):
-	pass
+	__slots__ = ()
 
 
 class While(AST):
+	__slots__ = ('op', 'comp', 'block', 'line_num')
+
 	def __init__(self, op, comp, block, line_num):
 		self.op = op
 		self.comp = comp
@@ -163,6 +202,8 @@ class While(AST):
 
 
 class For(AST):
+	__slots__ = ('iterator', 'block', 'elements', 'line_num')
+
 	def __init__(self, iterator, block, elements, line_num):
 		self.iterator = iterator
 		self.block = block
@@ -171,6 +212,8 @@ class For(AST):
 
 
 class LoopBlock(AST):
+	__slots__ = ('children',)
+
 	def __init__(self):
 		self.children = []
 
@@ -181,6 +224,8 @@ class LoopBlock(AST):
 
 
 class Switch(AST):
+	__slots__ = ('value', 'cases', 'line_num')
+
 	def __init__(self, value, cases, line_num):
 		self.value = value
 		self.cases = cases
@@ -188,6 +233,8 @@ class Switch(AST):
 
 
 class Case(AST):
+	__slots__ = ('value', 'block', 'line_num')
+
 	def __init__(self, value, block, line_num):
 		self.value = value
 		self.block = block
@@ -195,6 +242,8 @@ class Case(AST):
 
 
 class Break(AST):
+	__slots__ = ('line_num',)
+
 	def __init__(self, line_num):
 		self.line_num = line_num
 
@@ -205,6 +254,8 @@ class Break(AST):
 
 
 class Continue(AST):
+	__slots__ = ('line_num',)
+
 	def __init__(self, line_num):
 		self.line_num = line_num
 
@@ -215,6 +266,8 @@ class Continue(AST):
 
 
 class Pass(AST):
+	__slots__ = ('line_num',)
+
 	def __init__(self, line_num):
 		self.line_num = line_num
 
@@ -225,6 +278,8 @@ class Pass(AST):
 
 
 class BinOp(AST):
+	__slots__ = ('left', 'op', 'right', 'line_num')
+
 	def __init__(self, left, op, right, line_num):
 		self.left = left
 		self.op = op
@@ -233,6 +288,8 @@ class BinOp(AST):
 
 
 class UnaryOp(AST):
+	__slots__ = ('op', 'expr', 'line_num')
+
 	def __init__(self, op, expr, line_num):
 		self.op = op
 		self.expr = expr
@@ -240,6 +297,8 @@ class UnaryOp(AST):
 
 
 class Range(AST):
+	__slots__ = ('left', 'right', 'value', 'line_num')
+
 	def __init__(self, left, right, line_num):
 		self.left = left
 		self.right = right
@@ -248,6 +307,8 @@ class Range(AST):
 
 
 class CollectionAccess(AST):
+	__slots__ = ('collection', 'key', 'line_num')
+
 	def __init__(self, collection, key, line_num):
 		self.collection = collection
 		self.key = key
@@ -255,6 +316,8 @@ class CollectionAccess(AST):
 
 
 class DotAccess(AST):
+	__slots__ = ('obj', 'field', 'line_num')
+
 	def __init__(self, obj, field, line_num):
 		self.obj = obj
 		self.field = field
@@ -262,6 +325,8 @@ class DotAccess(AST):
 
 
 class Type(AST):
+	__slots__ = ('value', 'func_ret_type', 'line_num')
+
 	def __init__(self, value, line_num, func_ret_type=None):
 		self.value = value
 		self.func_ret_type = func_ret_type or []
@@ -269,6 +334,8 @@ class Type(AST):
 
 
 class AliasDeclaration(AST):
+	__slots__ = ('name', 'collection', 'line_num')
+
 	def __init__(self, name, collection, line_num):
 		self.name = name
 		self.collection = collection
@@ -276,16 +343,21 @@ class AliasDeclaration(AST):
 
 
 class Void(AST):
+	__slots__ = ()
 	value = VOID
 
 
 class Constant(AST):
+	__slots__ = ('value', 'line_num')
+
 	def __init__(self, value, line_num):
 		self.value = value
 		self.line_num = line_num
 
 
 class Num(AST):
+	__slots__ = ('value', 'val_type', 'line_num')
+
 	def __init__(self, value, val_type, line_num):
 		self.value = value
 		self.val_type = val_type
@@ -293,12 +365,16 @@ class Num(AST):
 
 
 class Str(AST):
+	__slots__ = ('value', 'line_num')
+
 	def __init__(self, value, line_num):
 		self.value = value
 		self.line_num = line_num
 
 
 class Collection(AST):
+	__slots__ = ('type', 'read_only', 'items', 'line_num')
+
 	def __init__(self, collection_type, line_num, read_only, *items):
 		self.type = collection_type
 		self.read_only = read_only
@@ -308,18 +384,57 @@ class Collection(AST):
 
 
 class HashMap(AST):
+	__slots__ = ('items', 'line_num')
+
 	def __init__(self, items, line_num):
 		self.items = items
 		self.line_num = line_num
 
 
 class Print(AST):
+	__slots__ = ('value', 'line_num')
+
 	def __init__(self, value, line_num):
 		self.value = value
 		self.line_num = line_num
 
 
 class Input(AST):
+	__slots__ = ('value', 'line_num', 'type')
+
 	def __init__(self, value, line_num):
 		self.value = value
 		self.line_num = line_num
+
+
+def iter_fields(node):
+	# Fields in name order, skipping slots that were never set
+	for name in node._fields:
+		try:
+			yield name, getattr(node, name)
+		except AttributeError:
+			pass
+
+
+def children(node):
+	# Slots that were never set read as None, which is not a child
+	for name in node._fields:
+		value = getattr(node, name, None)
+		if isinstance(value, AST):
+			yield value
+		elif isinstance(value, (list, tuple)):
+			for item in value:
+				if isinstance(item, AST):
+					yield item
+		elif isinstance(value, dict):
+			for item in value.values():
+				if isinstance(item, AST):
+					yield item
+
+
+def walk(node):
+	stack = [node]
+	while stack:
+		node = stack.pop()
+		yield node
+		stack.extend(children(node))
@@ -0,0 +1,115 @@
+import mmap
+import os
+import pickle
+import struct
+from copyreg import dispatch_table
+from hashlib import blake2b
+from my_grammar import GRAMMAR_VERSION
+from my_lexer import Lexer, Token
+from my_parser import Parser
+
+MAGIC = b'MYAST'
+HEADER = struct.Struct('<5sH16s')
+
+
+def reduce_token(token):
+	# Tokens kept in the tree only need their value, not the source text it was sliced from
+	return Token, (token.type, token.value, token.line_num, token.indent_level, token.value_type)
+
+
+def cache_directory():
+	# Unpickling runs code, so the cache is kept per user and never in the project: whoever can write
+	# a file there could otherwise run anything in the compiler by checking one in
+	base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(base, 'mythril')
+
+
+def trusted(stat):
+	# Only files of this user that nobody else can write are unpickled
+	if not hasattr(os, 'getuid'):
+		return True
+	return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+class ASTCache(object):
+	def __init__(self, directory=None):
+		self.directory = cache_directory() if directory is None else directory
+		self.hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def digest(code):
+		return blake2b(code.encode('utf-8'), digest_size=16).digest()
+
+	def path(self, digest):
+		return os.path.join(self.directory, '{}-{}.ast'.format(digest.hex(), GRAMMAR_VERSION))
+
+	def load(self, digest):
+		try:
+			with open(self.path(digest), 'rb') as file:
+				if not trusted(os.fstat(file.fileno())):
+					return None
+				with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+					magic, version, stored = HEADER.unpack_from(data)
+					if magic != MAGIC or version != GRAMMAR_VERSION or stored != digest:
+						raise ValueError('stale cache entry')
+					with memoryview(data) as view:
+						return pickle.loads(view[HEADER.size:])
+		except FileNotFoundError:
+			return None
+		except Exception:
+			# Anything at all can come out of unpickling a damaged file, all of it means parse again
+			self.discard(digest)
+			return None
+
+	def store(self, digest, tree):
+		path = self.path(digest)
+		temp = '{}.{}.tmp'.format(path, os.getpid())
+		try:
+			os.makedirs(self.directory, 0o700, exist_ok=True)
+			with os.fdopen(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o600), 'wb') as file:
+				file.write(HEADER.pack(MAGIC, GRAMMAR_VERSION, digest))
+				pickler = pickle.Pickler(file, pickle.HIGHEST_PROTOCOL)
+				pickler.dispatch_table = dict(dispatch_table)
+				pickler.dispatch_table[Token] = reduce_token
+				pickler.dump(tree)
+			os.replace(temp, path)
+		except (OSError, RecursionError, pickle.PicklingError):
+			# A tree that cannot be cached is still a good tree
+			self.discard_file(temp)
+
+	def discard(self, digest):
+		self.discard_file(self.path(digest))
+
+	@staticmethod
+	def discard_file(path):
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+	def parse(self, code, file_name=None):
+		digest = self.digest(code)
+		tree = self.load(digest)
+		if tree is not None:
+			self.hits += 1
+			return tree
+		self.misses += 1
+		tree = Parser(Lexer(code, file_name)).parse()
+		self.store(digest, tree)
+		return tree
+
+
+if __name__ == '__main__':
+	from time import time
+	file = 'test.my'
+	code = open(file).read()
+	cache = ASTCache()
+	cache.discard(cache.digest(code))
+	start = time()
+	tree = cache.parse(code, file)
+	print('parse and store', time() - start)
+	start = time()
+	cached = cache.parse(code, file)
+	print('load', time() - start)
+	print(str(cached) == str(tree), cache.hits, cache.misses)
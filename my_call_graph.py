@@ -0,0 +1,320 @@
+from copy import copy
+from my_ast import AST, AnonymousFunc, Assign, BinOp, Compound, Constant, For, FuncDecl, LoopBlock, Num, Pass
+from my_ast import Program, Str, StructDeclaration, UnaryOp, Var, VarDecl, children, iter_fields
+from my_resolver import resolve
+from my_symbol_table import RESOLUTION
+
+# Node fields that may hold a name, of a declaration or of a variable
+NAME_FIELDS = ('value', 'name', 'obj')
+# Declarations that are dropped when nothing reachable uses them
+DECLARATIONS = (FuncDecl, StructDeclaration)
+# Blocks of statements
+BLOCKS = (Compound, LoopBlock)
+# Expressions that only work out a value, assigning one does nothing else
+PURE = (Num, Str, Constant, Var, BinOp, UnaryOp)
+
+
+def names_in(node, found):
+	# Every name node and the nodes under it mention, leaving out string literals
+	stack = [node]
+	while stack:
+		node = stack.pop()
+		if not isinstance(node, Str):
+			for field in NAME_FIELDS:
+				value = getattr(node, field, None)
+				if type(value) is str:
+					found.add(value)
+		stack.extend(children(node))
+	return found
+
+
+class CallGraph(object):
+	# The Program and every FuncDecl and StructDeclaration are units. A unit calls the declarations whose
+	# names it mentions and that are in scope there: nested in it or in a unit around it. The bodies of
+	# the declarations nested in a unit are units of their own and not part of it. Names are not told
+	# apart any further, a unit may seem to call more than it does but never less
+	def __init__(self, tree):
+		self.tree = tree
+		self.names = {}
+		self.nested = {}
+		self.parent = {tree: None}
+		self.declarations = {}
+		# The node each node is in, for prune to find the blocks around what it drops
+		self.parents = {}
+		parents = self.parents
+		work = [tree]
+		while work:
+			unit = work.pop()
+			names = set()
+			nested = []
+			stack = [unit]
+			while stack:
+				node = stack.pop()
+				if node is not unit and isinstance(node, DECLARATIONS):
+					nested.append(node)
+					self.parent[node] = unit
+					self.declarations.setdefault(node.name, []).append(node)
+					continue
+				if node is not unit and not isinstance(node, Str):
+					for field in NAME_FIELDS:
+						value = getattr(node, field, None)
+						if type(value) is str:
+							names.add(value)
+				for child in children(node):
+					parents[child] = node
+					stack.append(child)
+			self.names[unit] = names
+			self.nested[unit] = nested
+			work.extend(nested)
+
+	def calls(self, unit):
+		around = set()
+		outer = unit
+		while outer is not None:
+			around.add(outer)
+			outer = self.parent[outer]
+		return [node for name in self.names[unit] for node in self.declarations.get(name, ()) if self.parent[node] in around]
+
+	def reachable(self):
+		# The units reachable from the top level statements
+		live = set()
+		work = [self.tree]
+		while work:
+			unit = work.pop()
+			if unit not in live:
+				live.add(unit)
+				work.extend(self.calls(unit))
+		return live
+
+
+class DeadAssignments(object):
+	# Assignments of a pure value to a variable nothing reads. Variables are told apart by the scope they
+	# are in and their slot there, as the resolver found them. A name used without a resolution counts as
+	# read in every scope, and a variable that is bound any other way than by a pure assignment keeps all
+	# of its assignments
+	def __init__(self, tree, live, resolution):
+		self.resolution = resolution
+		self.reads = {}
+		self.by_name = set()
+		self.bindings = {}
+		self.kept = set()
+		self.reads_of = {}
+		work = [(tree, ())]
+		while work:
+			scope, owners = work.pop()
+			work.extend(self.scope(scope, owners + (scope,), live))
+
+	def scope(self, scope, owners, live):
+		# Counts what the statements of scope read and bind, returns the scopes nested in it
+		nested = []
+		stack = [(scope.block, None)] if isinstance(scope, Program) else [(child, None) for child in children(scope)]
+		while stack:
+			node, block = stack.pop()
+			if isinstance(node, DECLARATIONS):
+				if node in live and isinstance(node, FuncDecl):
+					nested.append((node, owners))
+				continue
+			if isinstance(node, AnonymousFunc):
+				nested.append((node, owners))
+				continue
+			if isinstance(node, Assign) and isinstance(node.left, (Var, VarDecl)):
+				self.assignment(node, block, owners)
+				continue
+			if isinstance(node, Var):
+				self.read(node, owners, self.reads)
+				continue
+			if isinstance(node, VarDecl):
+				self.bind(node, owners)
+				stack.append((node.type, None))
+				continue
+			if isinstance(node, For):
+				for element in node.elements:
+					self.bind(element, owners)
+				stack.append((node.iterator, None))
+				stack.append((node.block, None))
+				continue
+			if not isinstance(node, Str):
+				for field in NAME_FIELDS:
+					value = getattr(node, field, None)
+					if type(value) is str:
+						self.by_name.add(value)
+			inside = node if isinstance(node, BLOCKS) else None
+			stack.extend((child, inside) for child in children(node))
+		return nested
+
+	def variable(self, node, owners):
+		where = self.resolution.get(node)
+		if where is None or where[0] >= len(owners):
+			return None
+		return owners[~where[0]], where[1]
+
+	def read(self, node, owners, reads):
+		variable = self.variable(node, owners)
+		if variable is None:
+			self.by_name.add(node.value)
+		else:
+			reads[variable] = reads.get(variable, 0) + 1
+
+	def bind(self, node, owners):
+		variable = self.variable(node, owners)
+		if variable is None:
+			names_in(node, self.by_name)
+		else:
+			self.kept.add(variable)
+
+	def assignment(self, node, block, owners):
+		left = node.left
+		variable = self.variable(node, owners)
+		reads = {}
+		if variable is None or block is None or not self.pure(node.right, owners, reads):
+			self.bind(node, owners)
+			names_in(node.right, self.by_name)
+			if isinstance(left, VarDecl):
+				names_in(left.type, self.by_name)
+			return
+		for read, count in reads.items():
+			self.reads[read] = self.reads.get(read, 0) + count
+		self.bindings.setdefault(variable, []).append(node)
+		self.reads_of[node] = reads
+
+	def pure(self, node, owners, reads):
+		# Whether node only works out a value, counting the variables it reads if it does
+		stack = [node]
+		while stack:
+			node = stack.pop()
+			if not isinstance(node, PURE):
+				return False
+			if isinstance(node, Var):
+				self.read(node, owners, reads)
+			stack.extend(children(node))
+		return True
+
+	def dead(self):
+		# Dropping the assignments of a variable drops what they read, which may leave another one unread
+		dropped = []
+		work = list(self.bindings)
+		done = set()
+		while work:
+			variable = work.pop()
+			if variable in done or variable in self.kept or self.reads.get(variable):
+				continue
+			assignments = self.bindings[variable]
+			if name_of(assignments[0]) in self.by_name:
+				continue
+			done.add(variable)
+			for node in assignments:
+				dropped.append(node)
+				for read, count in self.reads_of[node].items():
+					self.reads[read] -= count
+					if read in self.bindings:
+						work.append(read)
+		return dropped
+
+
+class DeadCode(object):
+	# What prune dropped, as (name, line number) pairs
+	def __init__(self):
+		self.functions = []
+		self.structs = []
+		self.assignments = []
+
+	def __bool__(self):
+		return bool(self.functions or self.structs or self.assignments)
+
+	def __str__(self):
+		lines = []
+		for kind, dropped in (('function', self.functions), ('struct', self.structs), ('assignment to', self.assignments)):
+			for name, line_num in sorted(dropped, key=lambda item: item[1]):
+				lines.append('Dropped {} {} (line {})'.format(kind, name, line_num))
+		return '\n'.join(lines)
+
+	__repr__ = __str__
+
+
+def name_of(node):
+	left = node.left
+	return left.value if isinstance(left, Var) else left.value.value
+
+
+def prune(tree, annotations=None):
+	# Drops the functions and structs that nothing reachable from the top level statements uses, and the
+	# assignments of pure values that nothing reads. Returns the pruned tree and what was dropped. The
+	# tree itself is left as it is, the IncrementalParser may hand its statements out again: the pruned
+	# tree shares what pruning did not touch and the blocks it did are copies, with their annotations
+	if annotations is None:
+		annotations = resolve(tree)
+	graph = CallGraph(tree)
+	live = graph.reachable()
+	report = DeadCode()
+	dropped = set()
+	for unit in live:
+		for node in graph.nested[unit]:
+			if node not in live:
+				dropped.add(node)
+				(report.functions if isinstance(node, FuncDecl) else report.structs).append((node.name, node.line_num))
+	for node in DeadAssignments(tree, live, annotations.table(RESOLUTION)).dead():
+		dropped.add(node)
+		report.assignments.append((name_of(node), node.line_num))
+	if not dropped:
+		return tree, report
+	return rebuilt(tree, dict.fromkeys(dropped), graph.parents, annotations), report
+
+
+def rebuilt(tree, replacements, parents, annotations):
+	# A copy of tree with each node in replacements swapped for its replacement, or dropped from the
+	# block it is in when that is None. Only the nodes around them are copied, innermost first, and the
+	# annotations of the nodes copied or replaced are carried over
+	dropped = {node for node, replacement in replacements.items() if replacement is None}
+	changed = {node: replacement for node, replacement in replacements.items() if replacement is not None}
+	for node, replacement in changed.items():
+		for table in annotations.tables.values():
+			if node in table:
+				table[replacement] = table[node]
+	depths = {tree: 0}
+	order = []
+	for node in replacements:
+		path = []
+		node = parents[node]
+		while node not in depths:
+			path.append(node)
+			node = parents[node]
+		depth = depths[node]
+		for node in reversed(path):
+			depth += 1
+			depths[node] = depth
+			order.append(node)
+	if tree not in order:
+		order.append(tree)
+
+	def swap(item):
+		return changed.get(item, item) if isinstance(item, AST) else item
+
+	for node in sorted(order, key=depths.get, reverse=True):
+		new = copy(node)
+		for name, value in iter_fields(node):
+			if isinstance(value, AST):
+				setattr(new, name, swap(value))
+			elif isinstance(value, (list, tuple)):
+				items = [swap(item) for item in value if not (isinstance(item, AST) and item in dropped)]
+				if isinstance(node, BLOCKS) and not items:
+					items = [Pass(next(item.line_num for item in value if item in dropped))]
+				setattr(new, name, type(value)(items))
+			elif isinstance(value, dict):
+				setattr(new, name, type(value)((key, swap(item)) for key, item in value.items()))
+		changed[node] = new
+		for table in annotations.tables.values():
+			if node in table:
+				table[new] = table[node]
+	return changed[tree]
+
+
+if __name__ == '__main__':
+	from my_lexer import Lexer
+	from my_parser import Parser
+	from my_preprocessor import Preprocessor
+	file = 'test.my'
+	tree = Parser(Lexer(open(file).read(), file)).parse()
+	annotations = resolve(tree)
+	Preprocessor(file).check(tree, annotations)
+	tree, report = prune(tree, annotations)
+	print(report or 'Nothing dropped')
@@ -0,0 +1,132 @@
+from my_ast import AST, Type, walk
+from my_hashcons import structural_hash
+from my_visitor import BuiltinTypeSymbol, Symbol
+
+# Node fields that may hold a name the checker looks up
+NAME_FIELDS = ('value', 'name', 'obj')
+# Symbol attributes checking a function never reads
+UNCHECKED = ('accessed', 'body')
+
+
+class FunctionCheck(object):
+	# What checking one function did: the warnings it gave, the outer symbols it marked accessed and the
+	# types it gave the nodes of the body, by their place in walk order
+	__slots__ = ('line_num', 'messages', 'accessed', 'typed', 'node', 'nodes')
+
+	def __init__(self, node, messages, accessed, typed, nodes=None):
+		self.line_num = node.line_num
+		self.messages = messages
+		self.accessed = accessed
+		self.typed = typed
+		self.node = node
+		self.nodes = nodes
+
+	def types(self, node):
+		# The typed nodes of node's body, which is the same as the body these were worked out for
+		if not self.typed:
+			return ()
+		if node is not self.node or self.nodes is None:
+			types = dict(self.typed)
+			self.nodes = [(child, types[index]) for index, child in enumerate(walk(node.body)) if index in types]
+			self.node = node
+		return self.nodes
+
+
+class CheckCache(object):
+	# Keeps what checking each function did, keyed by the structural hash of the function and what the
+	# names it uses stood for around it. A function is only checked again when one of those changed.
+	# Digests are kept by node for the functions of the last run, so a tree the IncrementalParser kept
+	# the unchanged declarations of is only hashed where it was edited
+	def __init__(self):
+		self.entries = {}
+		self.digests = {}
+		self.names = {}
+		self.used = {}
+		self.seen = {}
+		self.hits = 0
+		self.misses = 0
+
+	def digest(self, node):
+		found = self.digests.get(id(node))
+		if found is not None and found[0] is node:
+			digest = found[1]
+		else:
+			digest = structural_hash(node)
+		self.seen[id(node)] = node, digest
+		return digest
+
+	def names_of(self, node, digest):
+		names = self.names.get(digest)
+		if names is None:
+			found = set()
+			for child in walk(node):
+				for field in NAME_FIELDS:
+					value = getattr(child, field, None)
+					if type(value) is str:
+						found.add(value)
+			names = self.names[digest] = tuple(sorted(found))
+		return names
+
+	def key(self, node, file_name, lookup):
+		digest = self.digest(node)
+		names = self.names_of(node, digest)
+		return digest, file_name, tuple(signature(lookup(name)) for name in names)
+
+	def get(self, key, node):
+		entry = self.entries.get(key)
+		# Warnings carry line numbers, a function that gave some is checked again once it moves
+		if entry is None or entry.messages and entry.line_num != node.line_num:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self.used[key] = entry
+		return entry
+
+	def put(self, key, entry):
+		self.entries[key] = self.used[key] = entry
+
+	def sweep(self):
+		# Called at the end of a run, what that run did not use is dropped
+		self.entries, self.used = self.used, {}
+		self.digests, self.seen = self.seen, {}
+		self.names = {key[0]: self.names[key[0]] for key in self.entries}
+
+
+def signature(symbol):
+	# Everything about a symbol checking a function that uses it can depend on
+	if symbol is None:
+		return None
+	if isinstance(symbol, BuiltinTypeSymbol):
+		return symbol.name
+	return type(symbol).__name__, tuple(describe(value) for name, value in vars(symbol).items() if name not in UNCHECKED)
+
+
+def describe(value):
+	if value is None or type(value) in (str, int, bool, float):
+		return value
+	if isinstance(value, Type):
+		return value.value, describe(value.func_ret_type)
+	if isinstance(value, Symbol):
+		return signature(value)
+	if isinstance(value, AST):
+		return type(value).__name__, str(value)
+	if isinstance(value, dict):
+		return tuple((key, describe(item)) for key, item in value.items())
+	if isinstance(value, (list, tuple)):
+		return tuple(describe(item) for item in value)
+	return repr(value)
+
+
+if __name__ == '__main__':
+	from time import time
+	from my_parser import IncrementalParser
+	from my_preprocessor import Preprocessor
+	file = 'test.my'
+	code = open(file).read()
+	cache = CheckCache()
+	parser = IncrementalParser(file)
+	for run in range(3):
+		tree = parser.parse(code)
+		start = time()
+		Preprocessor(file, cache).check(tree)
+		print('check', time() - start, 'hits', cache.hits, 'misses', cache.misses)
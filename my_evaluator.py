@@ -0,0 +1,352 @@
+from my_ast import AnonymousFunc, Assign, BinOp, Break, Compound, Constant, Continue, Else, For, FuncCall, FuncDecl
+from my_ast import If, LoopBlock, Num, OpAssign, Pass, Range, Return, StructDeclaration, UnaryOp, Var, VarDecl, While
+from my_ast import children
+from my_call_graph import DECLARATIONS, CallGraph, rebuilt
+from my_grammar import *
+from my_interpreter import Interpreter
+from my_passes import Annotations, ConstantFolding, PassManager, wrap_int64
+from my_resolver import resolve
+from my_symbol_table import RESOLUTION
+
+# How many nodes evaluating one call may visit, and how deep its calls may nest, before it is given up on
+STEP_BUDGET = 100000
+CALL_DEPTH = 200
+# The only types a pure function works with, the ones ConstantFolding computes the way compiled code does
+VALUE_TYPES = {INT: int, BOOL: bool}
+# Nodes a pure function body may be made of
+PURE_NODES = (
+	Compound, LoopBlock, Assign, OpAssign, If, Else, While, For, Range, Break, Continue, Pass, Return,
+	BinOp, UnaryOp, Num, Constant, Var, FuncCall
+)
+OP_ASSIGNS = {PLUS_ASSIGN: PLUS, MINUS_ASSIGN: MINUS, MUL_ASSIGN: MUL, FLOORDIV_ASSIGN: FLOORDIV, MOD_ASSIGN: MOD}
+
+
+class NotConstant(Exception):
+	pass
+
+
+class Returned(object):
+	__slots__ = ('value',)
+
+	def __init__(self, value):
+		self.value = value
+
+
+class PureFunctions(object):
+	# The top level functions that only work out a value from their Int and Bool parameters: no print, no
+	# input, nothing read or written outside of their own scope, and calls only to other pure functions.
+	# A function is only looked into when it is asked for, along with every function it calls
+	def __init__(self, tree, resolution, graph=None):
+		self.resolution = resolution
+		graph = CallGraph(tree) if graph is None else graph
+		self.candidates = {}
+		for node in graph.nested[tree]:
+			if isinstance(node, FuncDecl) and len(graph.declarations[node.name]) == 1 and self.signature(node):
+				self.candidates[node.name] = node
+		self.functions = {}
+		self.decided = set()
+
+	def get(self, name):
+		if name not in self.decided and name in self.candidates:
+			self.decide(name)
+		return self.functions.get(name)
+
+	def decide(self, name):
+		# Looks into name and what it calls, directly or not, then drops a function calling one that is not
+		# pure until nothing changes
+		calls = {}
+		work = [name]
+		while work:
+			name = work.pop()
+			if name in calls or name in self.decided:
+				continue
+			found = self.calls(self.candidates[name]) if name in self.candidates else None
+			calls[name] = found
+			if found is not None:
+				work.extend(found)
+		pure = {name for name, found in calls.items() if found is not None}
+		changed = True
+		while changed:
+			changed = False
+			for name in list(pure):
+				if not all(callee in pure or callee in self.functions for callee in calls[name]):
+					pure.discard(name)
+					changed = True
+		for name in calls:
+			self.decided.add(name)
+			if name in pure:
+				self.functions[name] = self.candidates[name]
+
+	@staticmethod
+	def signature(node):
+		if node.varargs or node.return_type.value not in VALUE_TYPES:
+			return False
+		return all(typ.value in VALUE_TYPES for typ in node.parameters.values())
+
+	def calls(self, node):
+		# The names of the functions node's body calls, None when the body is not pure in itself
+		found = set()
+		stack = [node.body]
+		while stack:
+			node = stack.pop()
+			if not isinstance(node, PURE_NODES):
+				return None
+			if isinstance(node, Assign):
+				left = node.left
+				if isinstance(left, VarDecl):
+					if left.type.value not in VALUE_TYPES:
+						return None
+				elif not isinstance(left, Var):
+					return None
+				stack.append(node.right)
+				continue
+			if isinstance(node, (Var, OpAssign)):
+				where = self.resolution.get(node.left if isinstance(node, OpAssign) else node)
+				if where is None or where[0] != 0 or isinstance(node, OpAssign) and not isinstance(node.left, Var):
+					return None
+			if isinstance(node, For) and not (isinstance(node.iterator, Range) and len(node.elements) == 1):
+				return None
+			if isinstance(node, FuncCall):
+				if node.named_arguments:
+					return None
+				found.add(node.name)
+			stack.extend(children(node))
+		return found
+
+
+class ConstantEvaluator(Interpreter):
+	# Runs calls to pure functions. Int and Bool operations go through ConstantFolding, so they wrap and
+	# round the way the compiled code does, and anything it has no value for gives up on the call
+	def __init__(self, functions, annotations, file_name=None):
+		super().__init__(file_name)
+		self.use(annotations)
+		self.functions = functions
+		self.results = {}
+		self.steps = 0
+		self.depth = 0
+
+	def enter(self, node):
+		self.steps -= 1
+		if self.steps < 0:
+			raise NotConstant('out of steps')
+
+	def evaluate(self, name, arguments, budget=STEP_BUDGET):
+		# The value of calling name with arguments, None when it cannot be worked out within budget
+		key = name, tuple((type(value), value) for value in arguments)
+		if key not in self.results:
+			self.steps = budget
+			self.depth = 0
+			try:
+				self.results[key] = self.call(name, arguments)
+			except (NotConstant, RecursionError):
+				self.results[key] = None
+			self._scope[1:] = []
+		return self.results[key]
+
+	def call(self, name, arguments):
+		key = name, tuple((type(value), value) for value in arguments)
+		if key in self.results:
+			if self.results[key] is None:
+				raise NotConstant(name)
+			return self.results[key]
+		func = self.functions.get(name)
+		if func is None or len(arguments) != len(func.parameters) or self.depth >= CALL_DEPTH:
+			raise NotConstant(name)
+		self.new_scope(self.layouts.get(func, ()))
+		for (parameter, typ), value in zip(func.parameters.items(), arguments):
+			if type(value) is not VALUE_TYPES[typ.value]:
+				raise NotConstant(parameter)
+			self.define(parameter, value)
+		self.depth += 1
+		returned = self.visit(func.body)
+		self.depth -= 1
+		self.drop_top_scope()
+		if type(returned) is not Returned or type(returned.value) is not VALUE_TYPES[func.return_type.value]:
+			raise NotConstant(name)
+		self.results[key] = returned.value
+		return returned.value
+
+	def value(self, node):
+		value = self.visit(node)
+		if type(value) not in (int, bool):
+			raise NotConstant(node)
+		return value
+
+	def visit_compound(self, node):
+		for child in node.children:
+			result = yield child
+			if type(result) is Returned or result == BREAK or result == CONTINUE:
+				return result
+
+	visit_loopblock = visit_compound
+
+	def visit_return(self, node):
+		if node.value is None:
+			raise NotConstant(node)
+		return Returned(self.value(node.value))
+
+	def visit_if(self, node):
+		for comp, block in zip(node.comps, node.blocks):
+			if isinstance(comp, Else) or self.condition(comp):
+				return (yield block)
+
+	def condition(self, node):
+		value = self.value(node)
+		if type(value) is not bool:
+			raise NotConstant(node)
+		return value
+
+	def visit_while(self, node):
+		while self.condition(node.comp):
+			result = yield node.block
+			if result == BREAK:
+				break
+			if type(result) is Returned:
+				return result
+
+	def visit_for(self, node):
+		start, stop = self.value(node.iterator.left), self.value(node.iterator.right)
+		# The compiled loop compares without a sign
+		if type(start) is not int or type(stop) is not int or start < 0 or stop < 0:
+			raise NotConstant(node)
+		for value in range(start, stop):
+			self.define(node.elements[0].value, value)
+			result = yield node.block
+			if result == BREAK:
+				break
+			if type(result) is Returned:
+				return result
+
+	def visit_binop(self, node):
+		value = ConstantFolding.fold(node.op, self.value(node.left), self.value(node.right))
+		if value is None:
+			raise NotConstant(node)
+		return value
+
+	def visit_unaryop(self, node):
+		value = self.value(node.expr)
+		if node.op == NOT and type(value) is bool:
+			return not value
+		if type(value) is int:
+			if node.op == MINUS:
+				return wrap_int64(-value)
+			if node.op == PLUS:
+				return value
+		raise NotConstant(node)
+
+	def visit_assign(self, node):
+		value = self.value(node.right)
+		left = node.left
+		if isinstance(left, VarDecl):
+			if type(value) is not VALUE_TYPES[left.type.value]:
+				raise NotConstant(node)
+			self.define(left.value.value, value)
+		else:
+			self.define(left.value, value)
+
+	def visit_opassign(self, node):
+		op = OP_ASSIGNS.get(node.op)
+		value = None if op is None else ConstantFolding.fold(op, self.value(node.left), self.value(node.right))
+		if value is None:
+			raise NotConstant(node)
+		self.define(node.left.value, value)
+
+	def visit_var(self, node):
+		value = self.lookup(node.value, self.resolution.get(node))
+		if type(value) not in (int, bool):
+			raise NotConstant(node)
+		return value
+
+	def visit_constant(self, node):
+		if node.value == TRUE:
+			return True
+		if node.value == FALSE:
+			return False
+		raise NotConstant(node)
+
+	@staticmethod
+	def visit_num(node):
+		if type(node.value) is not int:
+			raise NotConstant(node)
+		return node.value
+
+	def visit_funccall(self, node):
+		return self.call(node.name, [self.value(argument) for argument in node.arguments])
+
+
+def fold_calls(tree, annotations=None, file_name=None, budget=STEP_BUDGET):
+	# Replaces the calls to pure functions whose arguments are constants with the value they return, as
+	# a Num or a Constant. Returns the new tree, which shares what was not changed, and the calls that
+	# were replaced as (name, arguments, value, line number)
+	if annotations is None:
+		annotations = resolve(tree)
+	resolution = annotations.table(RESOLUTION)
+	graph = CallGraph(tree)
+	pure = PureFunctions(tree, resolution, graph)
+	evaluator = ConstantEvaluator(pure, annotations, file_name)
+	# Only the arguments of the calls are folded, and the calls that were folded count as constants there
+	manager = PassManager([ConstantFolding()])
+	constants = Annotations()
+	values = constants.table(ConstantFolding.name)
+	replacements = {}
+	folded = []
+	for unit in graph.names:
+		if isinstance(unit, StructDeclaration) or graph.names[unit].isdisjoint(pure.candidates):
+			continue
+		owners = []
+		outer = unit
+		while outer is not None:
+			owners.append(outer)
+			outer = graph.parent[outer]
+		owners.reverse()
+		calls = []
+		stack = [(unit, tuple(owners))]
+		while stack:
+			node, owners = stack.pop()
+			if isinstance(node, FuncCall) and node.name in pure.candidates and not node.named_arguments:
+				calls.append((node, owners))
+			elif isinstance(node, AnonymousFunc):
+				owners = owners + (node,)
+			# The declarations nested in unit are units of their own
+			stack.extend((child, owners) for child in children(node) if not isinstance(child, DECLARATIONS))
+		# A call comes before the calls in its arguments, going backwards a call whose arguments are calls
+		# that were folded is folded too
+		for node, owners in reversed(calls):
+			where = resolution.get(node)
+			if where is None or where[0] >= len(owners) or owners[~where[0]] is not tree:
+				continue
+			arguments = []
+			for argument in node.arguments:
+				if argument not in values:
+					manager.run(argument, constants)
+				value = values.get(argument)
+				if type(value) not in (int, bool):
+					break
+				arguments.append(value)
+			else:
+				if pure.get(node.name) is None:
+					continue
+				value = evaluator.evaluate(node.name, arguments, budget)
+				if value is not None:
+					values[node] = value
+					if type(value) is bool:
+						replacements[node] = Constant(TRUE if value else FALSE, node.line_num)
+					else:
+						replacements[node] = Num(value, INT, node.line_num)
+					folded.append((node.name, tuple(arguments), value, node.line_num))
+	if not replacements:
+		return tree, folded
+	return rebuilt(tree, replacements, graph.parents, annotations), folded
+
+
+if __name__ == '__main__':
+	from my_lexer import Lexer
+	from my_parser import Parser
+	from my_preprocessor import Preprocessor
+	file = 'test.my'
+	tree = Parser(Lexer(open(file).read(), file)).parse()
+	annotations = resolve(tree)
+	Preprocessor(file).check(tree, annotations)
+	tree, folded = fold_calls(tree, annotations, file)
+	for name, arguments, value, line_num in folded:
+		print('{}{} = {} (line {})'.format(name, arguments, value, line_num))
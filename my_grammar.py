@@ -144,6 +144,33 @@ TYPE_OP = (AMPERSAND, PIPE, COMMA)
 
 MULTI_WORD_OPERATORS = (IS, IS_NOT, IN, NOT_IN, NOT)
 
+# Infix binding powers for Parser.expr, higher binds tighter
+BINDING_POWER = {
+	OR: 10,
+	AND: 20,
+	RANGE: 50,
+	XOR: 60,
+	BINARY_ONES_COMPLIMENT: 60,
+	BINARY_LEFT_SHIFT: 70,
+	BINARY_RIGHT_SHIFT: 70,
+	PLUS: 80,
+	MINUS: 80,
+	MUL: 90,
+	DIV: 90,
+	FLOORDIV: 90,
+	MOD: 90,
+	POWER: 100,
+	CAST: 110,
+}
+BINDING_POWER.update(dict.fromkeys(COMPARISON_OP, 40))
+
+NOT_BINDING_POWER = 30
+
+RIGHT_ASSOCIATIVE_OP = (POWER,)
+
+# Bump whenever the lexer or parser start producing different trees, it invalidates cached ASTs
+GRAMMAR_VERSION = 3
+
 OPERATORS = (
 	LPAREN, RPAREN, LSQUAREBRACKET, RSQUAREBRACKET, LCURLYBRACKET, RCURLYBRACKET,
 	ARROW, COMMA, COLON, DOT, DECORATOR, CAST, RANGE, ELLIPSIS,
@@ -0,0 +1,107 @@
+from collections import ChainMap
+from hashlib import blake2b
+from my_ast import AST, Constant, Num, Str, Type, children, iter_fields
+from my_lexer import Token
+
+# Node kinds nothing writes to after parsing and whose line numbers no warning reports,
+# so one node can stand in for all of its copies
+SHAREABLE = (Type, Constant, Num, Str)
+
+
+class HashCons(object):
+	def __init__(self, kinds=SHAREABLE):
+		self.kinds = kinds
+		self.table = {}
+		self.hashes = {}
+		self.hits = 0
+
+	def share(self, node):
+		if not isinstance(node, self.kinds):
+			return node
+		key = (type(node),) + tuple(self.key(value) for name, value in iter_fields(node) if name != 'line_num')
+		shared = self.table.get(key)
+		if shared is None:
+			# The first copy is kept, line number and all
+			self.table[key] = node
+			self.hashes[id(node)] = self.structural_hash(node)
+			return node
+		self.hits += 1
+		return shared
+
+	def key(self, value):
+		if isinstance(value, AST):
+			# Children are shared before their parents, so identical children are the same object.
+			# The table holds on to them, keeping their ids from being reused
+			return id(value)
+		if isinstance(value, (list, tuple)):
+			return type(value), tuple(self.key(item) for item in value)
+		if isinstance(value, dict):
+			return type(value), tuple((key, self.key(item)) for key, item in value.items())
+		# Decimal('1.0') == Decimal('1.00') but they do not print the same
+		return type(value), repr(value)
+
+	def share_tree(self, node):
+		# Shares the subtrees of a tree that was parsed without a HashCons
+		stack = [(node, False)]
+		while stack:
+			current, ready = stack.pop()
+			if not ready:
+				stack.append((current, True))
+				stack.extend((child, False) for child in children(current))
+				continue
+			for name, value in iter_fields(current):
+				shared = self.share_value(value)
+				if shared is not value:
+					setattr(current, name, shared)
+		return self.share(node)
+
+	def share_value(self, value):
+		# Lists and dicts are updated in place, tuples and nodes are swapped out
+		if isinstance(value, AST):
+			return self.share(value)
+		if isinstance(value, list):
+			value[:] = [self.share_value(item) for item in value]
+		elif isinstance(value, tuple):
+			return tuple(self.share_value(item) for item in value)
+		elif isinstance(value, dict):
+			for key, item in value.items():
+				value[key] = self.share_value(item)
+		return value
+
+	def structural_hash(self, node):
+		# Only digests of shared nodes are kept, other ids may be reused once their nodes are gone
+		return structural_hash(node, ChainMap({}, self.hashes))
+
+
+def structural_hash(node, memo=None):
+	# A blake2b digest of the node kind and fields of a subtree, line numbers left out, so it is the same
+	# from run to run and for every copy of the subtree. memo maps id(node) to digests already worked out
+	if memo is None:
+		memo = {}
+	stack = [(node, False)]
+	while stack:
+		current, ready = stack.pop()
+		if id(current) in memo:
+			continue
+		if not ready:
+			stack.append((current, True))
+			stack.extend((child, False) for child in children(current))
+			continue
+		parts = [type(current).__name__]
+		for name, value in iter_fields(current):
+			if name != 'line_num':
+				parts.append('{}={}'.format(name, describe(value, memo)))
+		memo[id(current)] = blake2b(' '.join(parts).encode('utf-8'), digest_size=16).digest()
+	return memo[id(node)]
+
+
+def describe(value, memo):
+	if isinstance(value, AST):
+		return memo[id(value)].hex()
+	if isinstance(value, (list, tuple)):
+		return '[' + ','.join(describe(item, memo) for item in value) + ']'
+	if isinstance(value, dict):
+		return '{' + ','.join('{}:{}'.format(repr(key), describe(item, memo)) for key, item in value.items()) + '}'
+	if isinstance(value, Token):
+		return 'Token({},{})'.format(value.type, repr(value.value))
+	return repr(value)
@@ -1,9 +1,10 @@
 from copy import deepcopy
 from decimal import Decimal
 from collections import OrderedDict
-from collections import Iterable
+from collections.abc import Iterable
 from enum import Enum
 from my_visitor import NodeVisitor
+from my_resolver import resolve
 from my_ast import FuncDecl
 from my_ast import VarDecl
 from my_ast import Else
@@ -18,11 +19,12 @@ class Interpreter(NodeVisitor):
 		self.file_name = file_name
 
 	def visit_program(self, node):
-		self.visit(node.block)
+		self.new_scope(self.layouts.get(node, ()))
+		yield node.block
 
 	def visit_compound(self, node):
 		for child in node.children:
-			temp = self.visit(child)
+			temp = yield child
 			if temp is not None:
 				return temp
 
@@ -42,16 +44,16 @@ class Interpreter(NodeVisitor):
 		for x, comp in enumerate(node.comps):
 			c = self.visit(comp)
 			if c == TRUE:
-				return self.visit(node.blocks[x])
+				return (yield node.blocks[x])
 			elif isinstance(comp, Else):
-				return self.visit(node.blocks[x])
+				return (yield node.blocks[x])
 
 	def visit_else(self, node):
 		pass
 
 	def visit_while(self, node):
 		while self.visit(node.comp) == TRUE:
-			if self.visit(node.block) == BREAK:
+			if (yield node.block) == BREAK:
 				break
 
 	def visit_for(self, node):
@@ -64,11 +66,11 @@ class Interpreter(NodeVisitor):
 					self.define(element.value, x[y])
 			else:
 				self.define(node.elements[0].value, x)
-			self.visit(node.block)
+			yield node.block
 
 	def visit_loopblock(self, node):
 		for child in node.children:
-			temp = self.visit(child)
+			temp = yield child
 			if temp == CONTINUE or temp == BREAK:
 				return temp
 
@@ -86,7 +88,7 @@ class Interpreter(NodeVisitor):
 		c = list(cases.values())
 		result = None
 		while result != BREAK and index < len(c):
-			result = self.visit(c[index])
+			result = yield c[index]
 			index += 1
 
 	def visit_case(self, node):
@@ -178,16 +180,17 @@ class Interpreter(NodeVisitor):
 		return range(left, right)
 
 	def visit_assign(self, node):
+		value = self.visit(node.right)
 		if isinstance(node.left, VarDecl):
 			var_name = node.left.value.value
 			if node.left.type.value == FLOAT:
-				node.right.value = float(node.right.value)
+				value = float(value)
 		else:
 			var_name = node.left.value
-			var_value = self.top_scope.get(var_name)
+			var_value = self.top_scope.get(var_name, slot=self.slot_of(node))
 			if var_value and isinstance(var_value, float):
-				node.right.value = float(node.right.value)
-		self.define(var_name, self.visit(node.right))
+				value = float(value)
+		self.define(var_name, value)
 
 	def visit_opassign(self, node):
 		var_name = node.left.value
@@ -209,7 +212,7 @@ class Interpreter(NodeVisitor):
 			self.top_scope[var_name] **= right
 
 	def visit_var(self, node):
-		return self.search_scopes(node.value)
+		return self.lookup(node.value, self.resolution.get(node))
 
 	def visit_funcdecl(self, node):
 		self.define(node.name.value, node)
@@ -289,7 +292,8 @@ class Interpreter(NodeVisitor):
 			key = node.key.value
 		return collection[key]
 
-	def interpret(self, tree):
+	def interpret(self, tree, annotations=None):
+		self.use(resolve(tree) if annotations is None else annotations)
 		return self.visit(tree)
 
 	def visit_print(self, node):
@@ -1,14 +1,79 @@
+import codecs
+import mmap
+import re
+from array import array
+from bisect import bisect_right
+from collections import deque
+from functools import partial
+from operator import attrgetter
+from sys import intern
+from itertools import zip_longest
 from my_grammar import *
 from decimal import Decimal
 
+OPERATOR_CHARS = ''.join(op for op in OPERATORS if len(op) == 1)
+RUN_OPERATOR_CHARS = ''.join(char for char in OPERATOR_CHARS if char not in SINGLE_OPERATORS)
+SINGLE_OPERATOR_CHARS = ''.join(char for char in OPERATOR_CHARS if char in SINGLE_OPERATORS)
+
+# Later entries win, so the order here mirrors the order of the checks in Lexer.get_next_token
+WORD_TYPES = dict.fromkeys(CONSTANTS, CONSTANT)
+WORD_TYPES.update(dict.fromkeys(TYPES, TYPE))
+WORD_TYPES.update(dict.fromkeys(KEYWORDS, KEYWORD))
+WORD_TYPES.update(dict.fromkeys(OPERATORS, OP))
+
+MULTI_WORDS = {
+	OP: frozenset(MULTI_WORD_OPERATORS),
+	KEYWORD: frozenset(MULTI_WORD_KEYWORDS),
+}
+
+_WORD_CHAR = r'[^\s#\\{}]'.format(re.escape(OPERATOR_CHARS))
+_TABS = re.compile(r'\t+')
+_WHITESPACE = re.compile(r'\s+')
+_WORD_TAIL = re.compile(_WORD_CHAR + '*')
+_TOKEN = re.compile('|'.join((
+	r'"(?P<double_quoted>(?:[^"\\]|\\"|\\(?!"))*)"',
+	r"'(?P<single_quoted>(?:[^'\\]|\\'|\\(?!'))*)'",
+	r'(?P<operator>[{}]|[{}]+)'.format(re.escape(SINGLE_OPERATOR_CHARS), re.escape(RUN_OPERATOR_CHARS)),
+	r'(?P<number>\d(?:\d|\.(?!\.))*)',
+	r'(?P<word>(?!\d){}+)'.format(_WORD_CHAR),
+	r'(?P<escape>\\)',
+)))
+_WORD_GAP = re.compile(r'[\s#]')
+
+CHUNK_SIZE = 1 << 16
+
+TOKEN_KINDS = (NUMBER, STRING, OP, NAME, KEYWORD, TYPE, CONSTANT, NEWLINE, ESCAPE, EOF)
+KIND_CODES = {kind: code for code, kind in enumerate(TOKEN_KINDS)}
+
 
 class Token(object):
-	def __init__(self, token_type, value, line_num, indent_level, value_type=None):
+	__slots__ = ('type', '_value', '_value_type', 'line_num', 'indent_level', 'source', 'start', 'end')
+
+	def __init__(self, token_type, value, line_num, indent_level, value_type=None, source=None, start=None, end=None):
 		self.type = token_type
-		self.value = value
-		self.value_type = value_type
+		self._value = value
+		self._value_type = value_type
 		self.line_num = line_num
 		self.indent_level = indent_level
+		self.source = source
+		self.start = start
+		self.end = end
+
+	def moved(self, source, offset, lines):
+		# A copy of the token, offset characters and lines further on in source
+		return Token(self.type, self._value, self.line_num + lines, self.indent_level, self._value_type, source, self.start + offset, self.end + offset)
+
+	@property
+	def value(self):
+		if self._value is None and self.source is not None:
+			self._value = span_value(self.source, self.type, self.start, self.end)
+		return self._value
+
+	@property
+	def value_type(self):
+		if self._value_type is None and self.type == NUMBER:
+			self._value_type = DEC if isinstance(self.value, Decimal) else INT
+		return self._value_type
 
 	def __str__(self):
 		return 'Token(type={type}, value={value}, line_num={line_num}, indent_level={indent_level})'.format(
@@ -21,18 +86,124 @@ class Token(object):
 	__repr__ = __str__
 
 
+class TokenStream(object):
+	def __init__(self, fill):
+		self.buffer = deque()
+		self._fill = fill
+
+	def next(self):
+		buffer = self.buffer
+		while not buffer:
+			self._fill()
+		return buffer.popleft()
+
+	def peek(self, num=1):
+		buffer = self.buffer
+		while len(buffer) < num:
+			self._fill()
+		return buffer[num - 1]
+
+
+class CompactTokens(object):
+	def __init__(self, text):
+		self.text = text
+		self.kinds = array('B')
+		self.starts = array('q')
+		self.ends = array('q')
+		self.lines = array('I')
+		self.indents = array('H')
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def __getitem__(self, index):
+		return span_token(
+			self.text,
+			TOKEN_KINDS[self.kinds[index]],
+			self.starts[index],
+			self.ends[index],
+			self.lines[index],
+			self.indents[index]
+		)
+
+	def add(self, kind, start, end, line_num, indent_level):
+		self.kinds.append(kind)
+		self.starts.append(start)
+		self.ends.append(end)
+		self.lines.append(line_num)
+		self.indents.append(indent_level)
+
+	def pop(self):
+		self.starts.pop()
+		self.ends.pop()
+		self.lines.pop()
+		self.indents.pop()
+		return TOKEN_KINDS[self.kinds.pop()]
+
+
+class CompactTokenStream(object):
+	def __init__(self, buffer, fill):
+		self.buffer = buffer
+		self.position = 0
+		self._fill = fill
+
+	def next(self):
+		token = self.peek()
+		self.position += 1
+		return token
+
+	def peek(self, num=1):
+		buffer = self.buffer
+		index = self.position + num - 1
+		while len(buffer) <= index:
+			self._fill()
+		return buffer[index]
+
+
+def span_token(source, token_type, start, end, line_num, indent_level):
+	return Token(token_type, None, line_num, indent_level, source=source, start=start, end=end)
+
+
+def span_value(source, token_type, start, end):
+	if token_type == NEWLINE:
+		return '\n'
+	if token_type == EOF:
+		return EOF
+	if token_type == ESCAPE:
+		return '\\'
+	value = source[start:end]
+	if token_type == STRING:
+		quote = value[0]
+		return value[1:-1].replace('\\' + quote, quote)
+	if token_type == NUMBER:
+		if '.' in value:
+			return Decimal(value)
+		return int(value)
+	if (token_type == OP or token_type == KEYWORD) and value not in WORD_TYPES:
+		# a multi word operator or keyword spans the gap between its words
+		value = _WORD_GAP.sub(' ', value, 1)
+	return intern(value)
+
+
 class Lexer(object):
-	def __init__(self, text, file_name=None):
+	def __init__(self, text, file_name=None, regex=False, compact=False):
 		self.text = text
 		self.file_name = file_name
+		self.regex = regex or compact
+		self.compact = compact
+		self._length = len(text)
 		self.pos = 0
-		self.current_char = self.text[self.pos]
+		self.current_char = self.text[self.pos] if text else None
 		self.char_type = None
 		self.word = ''
 		self.word_type = None
 		self._line_num = 1
 		self._indent_level = 0
 		self.current_token = None
+		if compact:
+			self.tokens = CompactTokenStream(CompactTokens(text), self.fill)
+		else:
+			self.tokens = TokenStream(self.fill)
 
 	def next_char(self):
 		self.pos += 1
@@ -45,6 +216,8 @@ class Lexer(object):
 
 	def reset_word(self):
 		old_word = self.word
+		if self.word_type == ALPHANUMERIC or self.word_type == OPERATIC:
+			old_word = intern(old_word)
 		self.word = ''
 		self.word_type = None
 		return old_word
@@ -59,24 +232,48 @@ class Lexer(object):
 	def preview_token(self, num=1):
 		if num < 1:
 			raise ValueError('num argument must be 1 or greater')
-		next_token = None
-		current_pos = self.pos
-		current_char = self.current_char
-		current_char_type = self.char_type
-		current_word = self.word
-		current_word_type = self.word_type
-		current_line_num = self.line_num
-		current_indent_level = self.indent_level
-		for _ in range(num):
-			next_token = self.get_next_token()
-		self.pos = current_pos
-		self.current_char = current_char
-		self.char_type = current_char_type
-		self.word = current_word
-		self.word_type = current_word_type
-		self._line_num = current_line_num
-		self._indent_level = current_indent_level
-		return next_token
+		return self.tokens.peek(num)
+
+	def seek(self, pos, line_num, indent_level=0):
+		self.pos = pos
+		self._line_num = line_num
+		self._indent_level = indent_level
+
+	def save_state(self):
+		return self.pos, self.current_char, self.char_type, self.word, self.word_type, self._line_num, self._indent_level
+
+	def restore_state(self, state):
+		self.pos, self.current_char, self.char_type, self.word, self.word_type, self._line_num, self._indent_level = state
+
+	def fill(self):
+		self.lex_token()
+
+	def lex_token(self):
+		if self.regex:
+			self.regex_token()
+			return
+		token = self.char_token()
+		if token is not None:
+			self.tokens.buffer.append(token)
+
+	def emit(self, token_type, start, end, line_num, indent_level):
+		if self.compact:
+			self.tokens.buffer.add(KIND_CODES[token_type], start, end, line_num, indent_level)
+		else:
+			self.tokens.buffer.append(span_token(self.text, token_type, start, end, line_num, indent_level))
+
+	def joins_next_word(self, partners, state):
+		# The word is already in the token buffer and the one after it goes in too, so the lookahead
+		# is only thrown away (and the lexer rewound to state) when the two words really join up
+		buffer = self.tokens.buffer
+		mark = len(buffer)
+		self.lex_token()
+		if buffer[mark].value in partners:
+			while len(buffer) >= mark:
+				buffer.pop()
+			self.restore_state(state)
+			return True
+		return False
 
 	def skip_whitespace(self):
 		if self.peek(-1) == '\n':
@@ -131,6 +328,9 @@ class Lexer(object):
 			self.increment_indent_level()
 			self.next_char()
 
+	def at_word_gap(self):
+		return self.current_char is not None and (self.current_char.isspace() or self.current_char == '#')
+
 	def eof(self):
 		return Token(EOF, EOF, self.line_num, self.indent_level)
 
@@ -150,6 +350,9 @@ class Lexer(object):
 			return ALPHANUMERIC
 
 	def get_next_token(self):
+		return self.tokens.next()
+
+	def char_token(self):
 		if self.current_char is None:
 			return self.eof()
 
@@ -164,7 +367,7 @@ class Lexer(object):
 
 		if self.current_char == '#':
 			self.skip_comment()
-			return self.get_next_token()
+			return self.char_token()
 
 		if self.current_char == '"':
 			self.next_char()
@@ -205,7 +408,11 @@ class Lexer(object):
 				self.next_char()
 
 			if self.word in OPERATORS:
-				if self.word in MULTI_WORD_OPERATORS and self.preview_token(1).value in MULTI_WORD_OPERATORS:
+				if self.word in MULTI_WORD_OPERATORS and self.at_word_gap():
+					state = self.save_state()
+					self.tokens.buffer.append(Token(OP, self.word, self.line_num, self.indent_level))
+					if not self.joins_next_word(MULTI_WORD_OPERATORS, state):
+						return
 					self.next_char()
 					self.word += ' '
 					while self.char_type == ALPHANUMERIC or self.char_type == NUMERIC:
@@ -216,7 +423,11 @@ class Lexer(object):
 					return Token(OP, self.reset_word(), self.line_num, self.indent_level)
 
 			if self.word in KEYWORDS:
-				if self.word in MULTI_WORD_KEYWORDS and self.preview_token(1).value in MULTI_WORD_KEYWORDS:
+				if self.word in MULTI_WORD_KEYWORDS and self.at_word_gap():
+					state = self.save_state()
+					self.tokens.buffer.append(Token(KEYWORD, self.word, self.line_num, self.indent_level))
+					if not self.joins_next_word(MULTI_WORD_KEYWORDS, state):
+						return
 					self.next_char()
 					self.word += ' '
 					while self.char_type == ALPHANUMERIC or self.char_type == NUMERIC:
@@ -258,6 +469,99 @@ class Lexer(object):
 
 		raise SyntaxError('Unknown character')
 
+	def regex_token(self):
+		text = self.text
+		length = self._length
+		pos = self.pos
+		while True:
+			if pos >= length:
+				self.pos = pos
+				return self.emit(EOF, pos, pos, self._line_num, self._indent_level)
+
+			char = text[pos]
+			if char == '\n':
+				self.emit(NEWLINE, pos, pos + 1, self._line_num, self._indent_level)
+				self._indent_level = 0
+				self._line_num += 1
+				self.pos = pos + 1
+				return
+
+			if char == '\t':
+				end = _TABS.match(text, pos).end()
+				self._indent_level += end - pos
+				pos = end
+				char = text[pos] if pos < length else None
+
+			if char is not None and char.isspace():
+				if text[pos - 1] == '\n':
+					raise SyntaxError('Only tab characters can indent')
+				pos = _WHITESPACE.match(text, pos).end()
+				char = text[pos] if pos < length else None
+
+			if char is None:
+				self.pos = pos
+				return self.emit(EOF, pos, pos, self._line_num, self._indent_level)
+
+			if char != '#':
+				break
+
+			# a comment swallows the newline that ends it, like Lexer.skip_comment
+			while char == '#':
+				pos = text.find('\n', pos)
+				if pos == -1:
+					pos = length
+					break
+				self._indent_level = 0
+				self._line_num += 1
+				pos += 1
+				char = text[pos] if pos < length else None
+
+		match = _TOKEN.match(text, pos)
+		kind = match.lastgroup
+		end = match.end()
+
+		if kind == 'word':
+			if char == '"' or char == "'":
+				self.pos = pos
+				if self.read_more():
+					return self.regex_token()
+				raise SyntaxError('Unterminated string')
+			word = match.group()
+			token_type = WORD_TYPES.get(word, NAME)
+			partners = MULTI_WORDS.get(token_type)
+			if partners and word in partners and end < length and (text[end].isspace() or text[end] == '#'):
+				self.pos = end
+				state = self.save_state()
+				self.emit(token_type, pos, end, self._line_num, self._indent_level)
+				if not self.joins_next_word(partners, state):
+					return
+				end = _WORD_TAIL.match(self.text, end + 1).end()
+			self.pos = end
+			return self.emit(token_type, pos, end, self._line_num, self._indent_level)
+
+		if kind == 'operator':
+			self.pos = end
+			return self.emit(OP, pos, end, self._line_num, self._indent_level)
+
+		if kind == 'number':
+			if end < length and _WORD_TAIL.match(text, end).end() > end:
+				raise SyntaxError('Variables cannot start with numbers')
+			self.pos = end
+			return self.emit(NUMBER, pos, end, self._line_num, self._indent_level)
+
+		if kind == 'double_quoted' or kind == 'single_quoted':
+			self.pos = end
+			return self.emit(STRING, pos, end, self._line_num, self._indent_level)
+
+		line_num = self._line_num
+		if end < length and text[end] == '\n':
+			self._line_num += 1
+		self.pos = end + 1
+		self.emit(ESCAPE, pos, end, line_num, self._indent_level)
+
+	def read_more(self):
+		return False
+
 	def analyze(self):
 		token = self.get_next_token()
 		while token.type != EOF:
@@ -266,11 +570,144 @@ class Lexer(object):
 		yield token
 
 
+class StreamLexer(Lexer):
+	def __init__(self, chunks, file_name=None, chunk_size=CHUNK_SIZE):
+		super().__init__('', file_name, regex=True)
+		self.chunks = iter(chunks)
+		self.chunk_size = chunk_size
+		self.offset = 0
+		self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+	@classmethod
+	def from_file(cls, file_name, chunk_size=CHUNK_SIZE):
+		return cls(read_chunks(file_name, chunk_size), file_name, chunk_size)
+
+	def fill(self):
+		# Only the text behind the current position is dropped, and only here, so the positions
+		# saved while lexing a token (or a multi word lookahead) stay valid
+		dead = self.pos - 1
+		if dead > self.chunk_size:
+			self.text = self.text[dead:]
+			self._length = len(self.text)
+			self.pos -= dead
+			self.offset += dead
+		self.lex_token()
+
+	def lex_token(self):
+		buffer = self.tokens.buffer
+		mark = len(buffer)
+		state = self.save_state()
+		self.regex_token()
+		# a token that runs into the end of the window may carry on in the next chunk
+		while self.pos >= self._length - 1 and self.read_more():
+			while len(buffer) > mark:
+				buffer.pop()
+			self.restore_state(state)
+			self.regex_token()
+
+	def read_more(self):
+		if self.chunks is None:
+			return False
+		for chunk in self.chunks:
+			if isinstance(chunk, bytes):
+				chunk = self._decoder.decode(chunk)
+			if chunk:
+				self.text += chunk
+				self._length = len(self.text)
+				return True
+		self.chunks = None
+		tail = self._decoder.decode(b'', final=True)
+		self.text += tail
+		self._length = len(self.text)
+		return bool(tail)
+
+
+def read_chunks(file_name, chunk_size=CHUNK_SIZE):
+	with open(file_name, 'rb') as file:
+		try:
+			source = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		except (ValueError, OSError):
+			# empty files (and some special files) cannot be mapped
+			yield from iter(partial(file.read, chunk_size), b'')
+			return
+		with source:
+			for start in range(0, len(source), chunk_size):
+				yield source[start:start + chunk_size]
+
+
+def looks_past_line(text, token):
+	# A multi word token only ends on its second word when that word sits one space or tab after the first.
+	# Joined any other way (through a comment or a longer gap) its lookahead may have run past the newline
+	# that ends its line
+	if token.type != OP and token.type != KEYWORD:
+		return False
+	lexeme = text[token.start:token.end]
+	return '#' in lexeme or lexeme[-1].isspace()
+
+
+def relex(tokens, text, start, end, replacement, file_name=None):
+	# tokens is the full list a regex Lexer produced for text. Returns the edited text and its tokens,
+	# lexing only from the line the edit starts on until a newline lines up with one in the old stream.
+	# tokens is left as it was: the new list shares the tokens before the edit and has moved copies of
+	# those after it
+	new_text = text[:start] + replacement + text[end:]
+	delta = len(replacement) - (end - start)
+	edit_end = start + len(replacement)
+
+	index = bisect_right(tokens, start, key=attrgetter('end'))
+	while index and tokens[index - 1].type != NEWLINE:
+		index -= 1
+	while index:
+		line_start = index - 1
+		while line_start and tokens[line_start - 1].type != NEWLINE:
+			line_start -= 1
+		if not any(looks_past_line(text, token) for token in tokens[line_start:index - 1]):
+			break
+		index = line_start
+	lexer = Lexer(new_text, file_name, regex=True)
+	if index:
+		restart = tokens[index - 1]
+		lexer.seek(restart.end, restart.line_num + 1)
+	new_tokens = tokens[:index]
+
+	old = index
+	for token in lexer.analyze():
+		new_tokens.append(token)
+		if token.type != NEWLINE or token.start < edit_end:
+			continue
+		old_end = token.end - delta
+		while old < len(tokens) and tokens[old].end < old_end:
+			old += 1
+		if old < len(tokens) and tokens[old].end == old_end and tokens[old].type == NEWLINE:
+			# A newline always leaves the lexer at indent 0 on the next line, so from here on
+			# the old tokens only need moving
+			line_delta = token.line_num - tokens[old].line_num
+			for tail in tokens[old + 1:]:
+				new_tokens.append(tail.moved(new_text, delta, line_delta))
+			break
+	return new_text, new_tokens
+
+
+def engine_mismatches(text, file_name=None, **options):
+	char_tokens = Lexer(text, file_name).analyze()
+	regex_tokens = Lexer(text, file_name, **(options or {'regex': True})).analyze()
+	mismatches = []
+	for char_token, regex_token in zip_longest(char_tokens, regex_tokens):
+		if char_token is None or regex_token is None or str(char_token) != str(regex_token) or char_token.value_type != regex_token.value_type:
+			mismatches.append((char_token, regex_token))
+	return mismatches
+
+
 if __name__ == '__main__':
 	file = 'test.my'
-	lexer = Lexer(open(file).read(), file)
+	code = open(file).read()
+	lexer = Lexer(code, file)
 	for t in lexer.analyze():
 		if t.type == NEWLINE:
 			print(t)
 		else:
 			print(t, end=' ')
+	for f in (file, 'example.my'):
+		for options in ({'regex': True}, {'compact': True}):
+			for expected, actual in engine_mismatches(open(f).read(), f, **options):
+				print('Engine mismatch in {} with {}: expected {} got {}'.format(f, options, expected, actual))
@@ -1,11 +1,16 @@
 from collections import OrderedDict
+from hashlib import blake2b
+from types import GeneratorType
 from my_ast import *
 from my_grammar import *
+from my_lexer import Lexer, Token, relex
 
 
 class Parser(object):
-	def __init__(self, lexer):
+	def __init__(self, lexer, shared=None):
 		self.lexer = lexer
+		self.shared = shared
+		self.tokens = lexer.tokens
 		self.file_name = lexer.file_name
 		self.current_token = None
 		self.indent_level = 0
@@ -13,13 +18,18 @@ class Parser(object):
 		self.user_types = []
 		self.in_class = False
 
+	def share(self, node):
+		if self.shared is None:
+			return node
+		return self.shared.share(node)
+
 	@property
 	def line_num(self):
 		return self.current_token.line_num
 
 	def next_token(self):
 		token = self.current_token
-		self.current_token = self.lexer.get_next_token()
+		self.current_token = self.tokens.next()
 		# print(self.current_token)
 		return token
 
@@ -36,16 +46,34 @@ class Parser(object):
 			raise SyntaxError
 
 	def preview(self, num=1):
-		return self.lexer.preview_token(num)
+		return self.tokens.peek(num)
+
+	@staticmethod
+	def run(routine):
+		# Block parsing routines are generators that yield the routine for each nested block and get its
+		# node sent back, so nesting depth lives on this stack instead of the Python call stack
+		stack = [routine]
+		result = None
+		while stack:
+			try:
+				routine = stack[-1].send(result)
+			except StopIteration as stop:
+				stack.pop()
+				result = stop.value
+			else:
+				stack.append(routine)
+				result = None
+		return result
 
 	def program(self):
 		root = Compound()
 		while self.current_token.type != EOF:
-			comp = self.compound_statement()
+			comp = self.run(self.compound_statement())
 			root.children.extend(comp.children)
 		return Program(root)
 
 	def struct_declaration(self):
+		line_num = self.line_num
 		self.eat_value(STRUCT)
 		name = self.next_token()
 		self.user_types.append(name.value)
@@ -58,7 +86,7 @@ class Parser(object):
 			fields[field] = field_type
 			self.eat_type(NEWLINE)
 		self.indent_level -= 1
-		return StructDeclaration(name.value, fields, self.line_num)
+		return StructDeclaration(name.value, fields, line_num)
 
 	def class_declaration(self):
 		base = None
@@ -76,7 +104,7 @@ class Parser(object):
 		self.indent_level += 1
 		while self.current_token.indent_level == self.indent_level:
 			if self.current_token.value == NEW:
-				constructor = self.constructor_declaration(class_name)
+				constructor = yield self.constructor_declaration(class_name)
 		self.indent_level -= 1
 		self.in_class = False
 		return ClassDeclaration(class_name.value, base=base, constructor=constructor, methods=methods, class_fields=class_fields, instance_fields=instance_fields)
@@ -101,6 +129,8 @@ class Parser(object):
 		return AliasDeclaration(name.value, (self.type_spec(),), self.line_num)
 
 	def function_declaration(self):
+		# Declarations carry the line they start on, self.line_num is past the body by the time it is parsed
+		line_num = self.line_num
 		self.eat_value(DEF)
 		if self.current_token.value == LPAREN:
 			name = ANON
@@ -142,14 +172,15 @@ class Parser(object):
 			return_type = self.type_spec()
 		self.eat_type(NEWLINE)
 		self.indent_level += 1
-		stmts = self.compound_statement()
+		stmts = yield self.compound_statement()
 		self.indent_level -= 1
 		if name == ANON:
-			return AnonymousFunc(return_type, params, stmts, self.line_num, param_defaults, vararg)
+			return AnonymousFunc(return_type, params, stmts, line_num, param_defaults, vararg)
 		else:
-			return FuncDecl(name.value, return_type, params, stmts, self.line_num, param_defaults, vararg)
+			return FuncDecl(name.value, return_type, params, stmts, line_num, param_defaults, vararg)
 
 	def constructor_declaration(self, class_name):
+		line_num = self.line_num
 		self.eat_value(NEW)
 		self.eat_value(LPAREN)
 		params = OrderedDict()
@@ -181,9 +212,9 @@ class Parser(object):
 		self.eat_value(RPAREN)
 		self.eat_type(NEWLINE)
 		self.indent_level += 1
-		stmts = self.compound_statement()
+		stmts = yield self.compound_statement()
 		self.indent_level -= 1
-		return FuncDecl('{}.constructor'.format(class_name), Void(), params, stmts, self.line_num, param_defaults, vararg)
+		return FuncDecl('{}.constructor'.format(class_name), Void(), params, stmts, line_num, param_defaults, vararg)
 
 	def bracket_literal(self):
 		token = self.next_token()
@@ -223,7 +254,7 @@ class Parser(object):
 		token = self.current_token
 		if token.value in self.user_types:
 			self.eat_type(NAME)
-			return Type(token.value, self.line_num)
+			return self.share(Type(token.value, self.line_num))
 		self.eat_type(TYPE)
 		type_spec = Type(token.value, self.line_num)
 		func_ret_type = None
@@ -233,10 +264,10 @@ class Parser(object):
 			self.eat_value(RSQUAREBRACKET)
 		if func_ret_type:
 			type_spec.func_ret_type = func_ret_type
-		return type_spec
+		return self.share(type_spec)
 
 	def compound_statement(self):
-		nodes = self.statement_list()
+		nodes = yield from self.statement_list()
 		root = Compound()
 		for node in nodes:
 			root.children.append(node)
@@ -244,13 +275,18 @@ class Parser(object):
 
 	def statement_list(self):
 		node = self.statement()
+		if isinstance(node, GeneratorType):
+			node = yield node
 		if self.current_token.type == NEWLINE:
 			self.next_token()
 		if isinstance(node, Return):
 			return [node]
 		results = [node]
 		while self.current_token.indent_level == self.indent_level:
-			results.append(self.statement())
+			node = self.statement()
+			if isinstance(node, GeneratorType):
+				node = yield node
+			results.append(node)
 			if self.current_token.type == NEWLINE:
 				self.next_token()
 			elif self.current_token.type == EOF:
@@ -480,25 +516,29 @@ class Parser(object):
 	def if_statement(self):
 		self.indent_level += 1
 		token = self.next_token()
-		comp = If(token.value, [self.expr()], [self.compound_statement()], token.indent_level, self.line_num)
+		comps = [self.expr()]
+		blocks = [(yield self.compound_statement())]
+		comp = If(token.value, comps, blocks, token.indent_level, self.line_num)
 		if self.current_token.indent_level < comp.indent_level:
 			self.indent_level -= 1
 			return comp
 		while self.current_token.value == ELSE_IF:
 			self.next_token()
 			comp.comps.append(self.expr())
-			comp.blocks.append(self.compound_statement())
+			comp.blocks.append((yield self.compound_statement()))
 		if self.current_token.value == ELSE:
 			self.next_token()
 			comp.comps.append(Else())
-			comp.blocks.append(self.compound_statement())
+			comp.blocks.append((yield self.compound_statement()))
 		self.indent_level -= 1
 		return comp
 
 	def while_statement(self):
 		self.indent_level += 1
 		token = self.next_token()
-		comp = While(token.value, self.expr(), self.loop_block(), self.line_num)
+		test = self.expr()
+		block = yield self.loop_block()
+		comp = While(token.value, test, block, self.line_num)
 		self.indent_level -= 1
 		return comp
 
@@ -514,7 +554,7 @@ class Parser(object):
 		iterator = self.expr()
 		if self.current_token.value == NEWLINE:
 			self.eat_type(NEWLINE)
-		block = self.loop_block()
+		block = yield self.loop_block()
 		loop = For(iterator, block, elements, self.line_num)
 		self.indent_level -= 1
 		return loop
@@ -526,7 +566,7 @@ class Parser(object):
 		if self.current_token.type == NEWLINE:
 			self.next_token()
 		while self.current_token.indent_level == self.indent_level:
-			switch.cases.append(self.case_statement())
+			switch.cases.append((yield self.case_statement()))
 			if self.current_token.type == NEWLINE:
 				self.next_token()
 			elif self.current_token.type == EOF:
@@ -544,12 +584,12 @@ class Parser(object):
 			value = DEFAULT
 		else:
 			raise SyntaxError
-		block = self.compound_statement()
+		block = yield self.compound_statement()
 		self.indent_level -= 1
 		return Case(value, block, self.line_num)
 
 	def loop_block(self):
-		nodes = self.statement_list()
+		nodes = yield from self.statement_list()
 		root = LoopBlock()
 		for node in nodes:
 			root.children.append(node)
@@ -579,48 +619,49 @@ class Parser(object):
 		return Var(token.value, self.line_num, read_only)
 
 	def constant(self, token):
-		return Constant(token.value, self.line_num)
+		return self.share(Constant(token.value, self.line_num))
 
 	def factor(self):
 		token = self.current_token
-		preview = self.preview()
-		if preview.value == DOT:
+		value = token.value
+		preview = self.preview().value
+		if preview == DOT:
 			self.next_token()
 			return self.dot_access(token)
-		elif token.value in (PLUS, MINUS):
+		elif value in (PLUS, MINUS):
 			self.next_token()
-			return UnaryOp(token.value, self.factor(), self.line_num)
-		elif token.value == NOT:
+			return UnaryOp(value, self.factor(), self.line_num)
+		elif value == NOT:
 			self.next_token()
-			return UnaryOp(token.value, self.expr(), self.line_num)
+			return UnaryOp(value, self.expr(NOT_BINDING_POWER), self.line_num)
 		elif token.type == NUMBER:
 			self.next_token()
-			return Num(token.value, token.value_type, self.line_num)
+			return self.share(Num(value, token.value_type, self.line_num))
 		elif token.type == STRING:
 			self.next_token()
-			return Str(token.value, self.line_num)
-		elif token.value == DEF:
-			return self.function_declaration()
+			return self.share(Str(value, self.line_num))
+		elif value == DEF:
+			return self.run(self.function_declaration())
 		elif token.type == TYPE:
 			return self.type_spec()
-		elif token.value == LPAREN:
-			if preview.value == RPAREN:
+		elif value == LPAREN:
+			if preview == RPAREN:
 				return []
 			else:
 				self.next_token()
 				node = self.expr()
 				self.eat_value(RPAREN)
 				return node
-		elif preview.value == LPAREN:
+		elif preview == LPAREN:
 			self.next_token()
 			return self.function_call(token)
-		elif preview.value == LSQUAREBRACKET:
+		elif preview == LSQUAREBRACKET:
 			self.next_token()
 			return self.square_bracket_expression(token)
-		elif token.value == LSQUAREBRACKET:
+		elif value == LSQUAREBRACKET:
 			self.next_token()
 			return self.square_bracket_expression(token)
-		elif token.value == LCURLYBRACKET:
+		elif value == LCURLYBRACKET:
 			self.next_token()
 			return self.curly_bracket_expression(token)
 		elif token.type == NAME:
@@ -632,25 +673,34 @@ class Parser(object):
 		else:
 			raise SyntaxError
 
-	def term(self):
+	def expr(self, min_power=0):
 		node = self.factor()
-		ops = (MUL, DIV, FLOORDIV, MOD, POWER, CAST, RANGE) + COMPARISON_OP + LOGICAL_OP + BINARY_OP
-		while self.current_token.value in ops:
-			token = self.next_token()
-			if token.value in COMPARISON_OP or token.value in LOGICAL_OP or token.value in BINARY_OP:
-				node = BinOp(node, token.value, self.expr(), self.line_num)
-			elif token.value == RANGE:
-				node = Range(node, self.expr(), self.line_num)
+		while True:
+			token = self.current_token
+			if token.type != OP:
+				return node
+			op = token.value
+			power = BINDING_POWER.get(op)
+			if power is None or power <= min_power:
+				return node
+			self.next_token()
+			if op == RANGE:
+				node = Range(node, self.expr(power), self.line_num)
+			elif op in RIGHT_ASSOCIATIVE_OP:
+				node = BinOp(node, op, self.expr(power - 1), self.line_num)
 			else:
-				node = BinOp(node, token.value, self.factor(), self.line_num)
-		return node
+				node = BinOp(node, op, self.expr(power), self.line_num)
 
-	def expr(self):
-		node = self.term()
-		while self.current_token.value in (PLUS, MINUS):
-			token = self.next_token()
-			node = BinOp(node, token.value, self.term(), self.line_num)
-		return node
+	def declarations(self):
+		# The top level statements one at a time, each handed out before the next one is parsed
+		while self.current_token.type != EOF:
+			node = self.statement()
+			if isinstance(node, GeneratorType):
+				node = self.run(node)
+			if self.current_token.type == NEWLINE:
+				self.next_token()
+			if node is not None:
+				yield node
 
 	def parse(self):
 		node = self.program()
@@ -658,6 +708,107 @@ class Parser(object):
 			raise SyntaxError('Unexpected end of program')
 		return node
 
+
+class Declaration(object):
+	def __init__(self, nodes, user_types, line_num, start, end):
+		self.nodes = nodes
+		self.user_types = user_types
+		self.line_num = line_num
+		self.start = start
+		self.end = end
+
+
+class IncrementalParser(object):
+	def __init__(self, file_name=None):
+		self.file_name = file_name
+		self.text = None
+		self.tokens = None
+		self.declarations = {}
+		self.reused = 0
+
+	def parse(self, text):
+		tokens = list(Lexer(text, self.file_name, regex=True).analyze())
+		return self.parse_tokens(text, tokens)
+
+	def edit(self, start, end, replacement):
+		text, tokens = relex(self.tokens, self.text, start, end, replacement, self.file_name)
+		return self.parse_tokens(text, tokens)
+
+	@staticmethod
+	def top_level_starts(tokens):
+		# A top level statement starts on a fresh line at indent 0, outside of any brackets,
+		# unless it carries on an if statement
+		depth = 0
+		yield 0
+		for index in range(1, len(tokens) - 1):
+			token = tokens[index]
+			if (
+				depth == 0 and token.indent_level == 0 and tokens[index - 1].type == NEWLINE
+				and token.type != NEWLINE and token.value != ELSE and token.value != ELSE_IF
+			):
+				yield index
+			if token.type == OP:
+				if token.value in (LPAREN, LSQUAREBRACKET, LCURLYBRACKET):
+					depth += 1
+				elif token.value in (RPAREN, RSQUAREBRACKET, RCURLYBRACKET):
+					depth -= 1
+
+	@staticmethod
+	def move(declaration, first, text):
+		line_shift = first.line_num - declaration.line_num
+		offset_shift = first.start - declaration.start
+		for node in declaration.nodes:
+			for child in walk(node):
+				if line_shift and hasattr(child, 'line_num'):
+					child.line_num += line_shift
+				for key, value in iter_fields(child):
+					# relex already moved the tokens it kept, only the ones it lexed again are left behind
+					if isinstance(value, Token) and value.source is not text:
+						value.source = text
+						value.start += offset_shift
+						value.end += offset_shift
+						value.line_num += line_shift
+		declaration.line_num = first.line_num
+		declaration.start = first.start
+
+	def parse_tokens(self, text, tokens):
+		declarations = {}
+		user_types = []
+		root = Compound()
+		self.reused = 0
+		starts = list(self.top_level_starts(tokens))
+		starts.append(len(tokens) - 1)
+		for start, stop in zip(starts, starts[1:]):
+			first = tokens[start]
+			following = tokens[stop]
+			digest = blake2b(text[first.start:following.start].encode('utf-8'), digest_size=16).digest()
+			key = (digest, frozenset(user_types), 0)
+			while key in declarations:
+				# identical statements each get their own nodes
+				key = key[:2] + (key[2] + 1,)
+			declaration = self.declarations.get(key)
+			if declaration is None:
+				lexer = Lexer(text, self.file_name, regex=True)
+				lexer.seek(len(text), following.line_num, following.indent_level)
+				lexer.tokens.buffer.extend(tokens[start:stop])
+				parser = Parser(lexer)
+				parser.user_types = list(user_types)
+				nodes = parser.parse().block.children
+				declaration = Declaration(nodes, parser.user_types[len(user_types):], first.line_num, first.start, following.start)
+			else:
+				self.reused += 1
+				if declaration.line_num != first.line_num or declaration.start != first.start:
+					self.move(declaration, first, text)
+				declaration.end = following.start
+			declarations[key] = declaration
+			user_types.extend(declaration.user_types)
+			root.children.extend(declaration.nodes)
+		self.text = text
+		self.tokens = tokens
+		self.declarations = declarations
+		return Program(root)
+
+
 if __name__ == '__main__':
 	from my_lexer import Lexer
 	file = 'test.my'
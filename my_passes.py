@@ -0,0 +1,254 @@
+from my_ast import BinOp, Constant, Else, For, If, Num, UnaryOp, While, children
+from my_grammar import *
+
+INT64_MIN = -(1 << 63)
+
+
+class Annotations(object):
+	# What the passes worked out about each node, one table per pass name. Nodes are keyed by identity,
+	# so a node shared through a HashCons has one annotation wherever it appears
+	def __init__(self):
+		self.tables = {}
+
+	def table(self, name):
+		table = self.tables.get(name)
+		if table is None:
+			table = self.tables[name] = {}
+		return table
+
+	def get(self, node, name, default=None):
+		table = self.tables.get(name)
+		if table is None:
+			return default
+		return table.get(node, default)
+
+	def set(self, node, name, value):
+		self.table(name)[node] = value
+
+	def __contains__(self, name):
+		return name in self.tables
+
+
+class AnalysisPass(object):
+	# name is the annotation table it fills in, kinds the node types it looks at (all of them when empty)
+	# and requires the names of the passes it reads from. A pass only sees a node once: enter on the
+	# way down, leave on the way up, when the annotations of the node's children are already there.
+	# Whatever leave returns, other than None, is the node's annotation
+	name = None
+	kinds = ()
+	requires = ()
+
+	def start(self, tree, annotations):
+		pass
+
+	def enter(self, node, annotations):
+		pass
+
+	def leave(self, node, annotations):
+		pass
+
+	def finish(self, tree, annotations):
+		pass
+
+
+class PassManager(object):
+	def __init__(self, passes=()):
+		self.passes = []
+		self.traversals = 0
+		for analysis in passes:
+			self.add(analysis)
+
+	def add(self, analysis):
+		if any(other.name == analysis.name for other in self.passes):
+			raise ValueError('pass {} added twice'.format(analysis.name))
+		self.passes.append(analysis)
+		return analysis
+
+	def stages(self):
+		# Every pass runs one traversal after the last of the passes it requires, so passes that do not
+		# depend on each other end up in the same traversal
+		by_name = {analysis.name: analysis for analysis in self.passes}
+		levels = {}
+		for analysis in self.passes:
+			stack = [(analysis, False)]
+			visiting = set()
+			while stack:
+				current, ready = stack.pop()
+				if current.name in levels:
+					continue
+				if ready:
+					visiting.discard(current.name)
+					levels[current.name] = 1 + max((levels[name] for name in current.requires), default=-1)
+					continue
+				if current.name in visiting:
+					raise ValueError('passes {} require each other'.format(current.name))
+				visiting.add(current.name)
+				stack.append((current, True))
+				for name in current.requires:
+					if name not in by_name:
+						raise ValueError('pass {} requires {}, which was not added'.format(current.name, name))
+					stack.append((by_name[name], False))
+		stages = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+		for analysis in self.passes:
+			stages[levels[analysis.name]].append(analysis)
+		return stages
+
+	def run(self, tree, annotations=None):
+		if annotations is None:
+			annotations = Annotations()
+		for stage in self.stages():
+			self.traverse(tree, stage, annotations)
+		return annotations
+
+	def traverse(self, tree, passes, annotations):
+		self.traversals += 1
+		for analysis in passes:
+			annotations.table(analysis.name)
+			analysis.start(tree, annotations)
+		hooks = {}
+		stack = [(tree, False)]
+		while stack:
+			node, ready = stack.pop()
+			kind = type(node)
+			interested = hooks.get(kind)
+			if interested is None:
+				interested = hooks[kind] = [analysis for analysis in passes if not analysis.kinds or issubclass(kind, analysis.kinds)]
+			if ready:
+				for analysis in interested:
+					value = analysis.leave(node, annotations)
+					if value is not None:
+						annotations.tables[analysis.name][node] = value
+				continue
+			for analysis in interested:
+				analysis.enter(node, annotations)
+			stack.append((node, True))
+			stack.extend((child, False) for child in children(node))
+		for analysis in passes:
+			analysis.finish(tree, annotations)
+
+
+def wrap_int64(value):
+	# Ints are 64 bits once compiled, folding has to overflow the same way
+	return (value - INT64_MIN) % (1 << 64) + INT64_MIN
+
+
+class ConstantFolding(AnalysisPass):
+	# The value of every Int or Bool expression that is known before the program runs. Dec expressions
+	# are left to run time, folding them with Decimal would not round the way doubles do
+	name = 'constant'
+	kinds = (Num, Constant, UnaryOp, BinOp)
+
+	def leave(self, node, annotations):
+		if isinstance(node, Num):
+			if type(node.value) is int:
+				return node.value
+		elif isinstance(node, Constant):
+			if node.value == TRUE:
+				return True
+			if node.value == FALSE:
+				return False
+		elif isinstance(node, UnaryOp):
+			value = annotations.get(node.expr, self.name)
+			if value is None:
+				return None
+			if node.op == NOT and type(value) is bool:
+				return not value
+			if type(value) is int:
+				if node.op == MINUS:
+					return wrap_int64(-value)
+				if node.op == PLUS:
+					return value
+		else:
+			return self.fold(node.op, annotations.get(node.left, self.name), annotations.get(node.right, self.name))
+
+	@staticmethod
+	def fold(op, left, right):
+		if type(left) is bool and type(right) is bool:
+			if op == AND:
+				return left and right
+			if op == OR:
+				return left or right
+			if op == EQUALS:
+				return left == right
+			if op == NOT_EQUALS:
+				return left != right
+			return None
+		if type(left) is not int or type(right) is not int:
+			return None
+		if op == PLUS:
+			return wrap_int64(left + right)
+		if op == MINUS:
+			return wrap_int64(left - right)
+		if op == MUL:
+			return wrap_int64(left * right)
+		if op in (FLOORDIV, MOD):
+			if right == 0:
+				return None
+			# sdiv and srem round towards zero
+			quotient = abs(left) // abs(right) * (1 if (left < 0) == (right < 0) else -1)
+			return wrap_int64(quotient) if op == FLOORDIV else left - quotient * right
+		if op == EQUALS:
+			return left == right
+		if op == NOT_EQUALS:
+			return left != right
+		if op == LESS_THAN:
+			return left < right
+		if op == LESS_THAN_OR_EQUAL_TO:
+			return left <= right
+		if op == GREATER_THAN:
+			return left > right
+		if op == GREATER_THAN_OR_EQUAL_TO:
+			return left >= right
+
+
+class LoopNesting(AnalysisPass):
+	# How many loops each loop is inside of
+	name = 'loop_depth'
+	kinds = (While, For)
+
+	def start(self, tree, annotations):
+		self.depth = 0
+
+	def enter(self, node, annotations):
+		annotations.set(node, self.name, self.depth)
+		self.depth += 1
+
+	def leave(self, node, annotations):
+		self.depth -= 1
+
+
+class ConstantConditions(AnalysisPass):
+	# For an If, the index of the block that always runs, or the number of blocks when none of them can.
+	# For a While, False when its body never runs
+	name = 'taken_branch'
+	kinds = (If, While)
+	requires = (ConstantFolding.name,)
+
+	def leave(self, node, annotations):
+		if isinstance(node, While):
+			if annotations.get(node.comp, ConstantFolding.name) is False:
+				return False
+			return None
+		for index, comp in enumerate(node.comps):
+			value = annotations.get(comp, ConstantFolding.name)
+			if value is True or isinstance(comp, Else):
+				return index
+			if value is not False:
+				return None
+		return len(node.comps)
+
+
+def default_passes():
+	return [ConstantFolding(), LoopNesting(), ConstantConditions()]
+
+
+if __name__ == '__main__':
+	from my_lexer import Lexer
+	from my_parser import Parser
+	file = 'test.my'
+	tree = Parser(Lexer(open(file).read(), file)).parse()
+	manager = PassManager(default_passes())
+	annotations = manager.run(tree)
+	print('traversals', manager.traversals, 'stages', [[analysis.name for analysis in stage] for stage in manager.stages()])
+	for name, table in annotations.tables.items():
+		print(name, len(table))
@@ -0,0 +1,123 @@
+from my_ast import Compound, FuncDecl, StructDeclaration
+from my_grammar import *
+from my_lexer import CHUNK_SIZE, StreamLexer
+from my_parser import Parser
+from my_passes import Annotations
+from my_preprocessor import Preprocessor
+from my_visitor import FuncSymbol
+from compiler.my_compiler import CodeGenerator
+
+
+def skip_statement(parser):
+	# Moves the parser on to the start of the next top level statement without building anything
+	depth = 0
+	while parser.current_token.type != EOF:
+		token = parser.next_token()
+		if token.value in (LPAREN, LSQUAREBRACKET, LCURLYBRACKET) and token.type == OP:
+			depth += 1
+		elif token.value in (RPAREN, RSQUAREBRACKET, RCURLYBRACKET) and token.type == OP:
+			depth -= 1
+		current = parser.current_token
+		if (
+			token.type == NEWLINE and depth == 0 and current.indent_level == 0
+			and current.type != NEWLINE and current.value != ELSE and current.value != ELSE_IF
+		):
+			return
+
+
+def function_signature(parser):
+	# Parses a function declaration up to its body, which is skipped, and returns it with an empty body
+	routine = parser.function_declaration()
+	routine.send(None).close()
+	skip_statement(parser)
+	try:
+		routine.send(Compound())
+	except StopIteration as stop:
+		return stop.value
+
+
+class Pipeline(object):
+	def __init__(self, file_name, chunk_size=CHUNK_SIZE):
+		self.file_name = file_name
+		self.chunk_size = chunk_size
+		self.checker = Preprocessor(file_name)
+		self.generator = CodeGenerator(file_name)
+		# Statements are not resolved ahead, but the types the checker gives them still reach the generator
+		self.annotations = Annotations()
+		self.checker.use(self.annotations)
+		self.generator.use(self.annotations)
+		self.forward = {}
+
+	def parser(self):
+		return Parser(StreamLexer.from_file(self.file_name, self.chunk_size))
+
+	def prescan(self):
+		# Declarations first: every top level function signature and struct, so a statement can use
+		# one that is declared further down the file
+		parser = self.parser()
+		declarations = []
+		while parser.current_token.type != EOF:
+			if parser.current_token.value == DEF:
+				declarations.append(function_signature(parser))
+			elif parser.current_token.value == STRUCT:
+				declarations.append(parser.struct_declaration())
+				if parser.current_token.type == NEWLINE:
+					parser.next_token()
+			else:
+				skip_statement(parser)
+		return declarations, parser.user_types
+
+	def declare(self, declarations):
+		checker = self.checker
+		generator = self.generator
+		for node in declarations:
+			if isinstance(node, StructDeclaration):
+				checker.visit(node)
+				generator.visit(node)
+			elif isinstance(node, FuncDecl):
+				symbol = FuncSymbol(node.name, checker.search_scopes(node.return_type.value), node.parameters, None, node.parameter_defaults)
+				checker.define(node.name, symbol)
+				generator.define(node.name, generator.declare_function(node.name, node.return_type, node.parameters, node.parameter_defaults))
+				self.forward[node.name] = symbol
+
+	def run(self):
+		# Yields each top level statement once it is checked and, while there are no warnings, lowered
+		# to IR. Nothing holds on to it after that, so only the statement being compiled is in memory
+		declarations, user_types = self.prescan()
+		self.declare(declarations)
+		del declarations
+		parser = self.parser()
+		parser.user_types = list(user_types)
+		checker = self.checker
+		for node in parser.declarations():
+			if isinstance(node, StructDeclaration):
+				# already declared by the prescan
+				yield node
+				continue
+			checker.visit(node)
+			if isinstance(node, FuncDecl):
+				symbol = checker.search_scopes(node.name)
+				forward = self.forward.pop(node.name, None)
+				if forward is not None and forward.accessed:
+					symbol.accessed = True
+				# the function body has been checked, it is not needed to check calls to it
+				symbol.body = None
+			if not checker.warnings:
+				self.generator.visit(node)
+			yield node
+		checker.warn_unused()
+		if not checker.warnings:
+			self.generator.end_main()
+
+	def compile(self):
+		for node in self.run():
+			pass
+		return not self.checker.warnings
+
+
+if __name__ == '__main__':
+	pipeline = Pipeline('test.my')
+	if pipeline.compile():
+		pipeline.generator.evaluate(False, True, False)
+	else:
+		print('Did not run')
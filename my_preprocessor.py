@@ -1,5 +1,9 @@
+import multiprocessing
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from my_visitor import NodeVisitor, StructSymbol
+from my_visitor import BuiltinTypeSymbol
 from my_visitor import VarSymbol
 from my_visitor import CollectionSymbol
 from my_visitor import FuncSymbol
@@ -7,7 +11,11 @@ from my_visitor import AliasSymbol
 from my_ast import VarDecl, DotAccess, CollectionAccess
 from my_ast import Var
 from my_ast import Collection
+from my_ast import walk
+from my_check_cache import FunctionCheck
+from my_resolver import resolve
 from my_grammar import *
+from my_types import BUILTIN_TYPES
 
 
 def flatten(container):
@@ -27,11 +35,28 @@ def warning_on_one_line(message, category, filename, lineno, file=None, line=Non
 
 warnings.formatwarning = warning_on_one_line
 
+# The tree a worker process checks, with the resolver's tables and the file name
+worker_tree = None
+# Workers are forked so they start with the tree instead of being sent it, where there is no fork
+# functions are checked one after another
+FORK = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+
 
 class Preprocessor(NodeVisitor):
-	def __init__(self, file_name=None):
+	def __init__(self, file_name=None, cache=None, workers=None):
 		super().__init__()
 		self.file_name = file_name
+		self.cache = cache
+		self.workers = workers
+		# Set while checking in parallel: top level functions are counted in source order, the parent
+		# puts their bodies aside as jobs and a worker only checks the ones it owns, by ordinal with the
+		# names to keep track of
+		self.ordinal = None
+		self.jobs = None
+		self.owned = None
+		self.results = None
+		self.current = None
+		self.recorded = None
 		self.warnings = False
 		self.return_flag = False
 		# self.num_types = (
@@ -44,20 +69,103 @@ class Preprocessor(NodeVisitor):
 		# 	self.search_scopes(FLOAT)
 		# )
 
-	def check(self, node):
-		res = self.visit(node)
-		if self.unvisited_symbols:
-			warnings.warn('Unused variables ({})'.format(','.join(sym_name for sym_name in self.unvisited_symbols)))
+	def check(self, node, annotations=None):
+		self.use(resolve(node) if annotations is None else annotations)
+		if self.workers and FORK is not None:
+			res = self.check_in_parallel(node)
+		elif self.cache is not None:
+			with self.held_back():
+				res = self.visit(node)
+		else:
+			res = self.visit(node)
+		self.warn_unused()
+		if self.cache is not None:
+			self.cache.sweep()
 		return res
 
+	def check_in_parallel(self, node):
+		# Top level function bodies are put aside while everything else is checked. Every worker process
+		# then checks the whole tree again, which is cheap without the bodies, and checks the bodies it was
+		# given where they are, so each sees the symbols around it as checking them one after another
+		# would. The results are merged in source order and the warnings come out in the same order too
+		self.ordinal = 0
+		self.jobs = []
+		with self.held_back() as held:
+			res = self.visit(node)
+			recorded = held[:]
+			del held[:]
+		jobs, self.jobs, self.ordinal = self.jobs, None, None
+		results = {}
+		if jobs:
+			# With a cache, the names each function may use go with it so what it first used can be kept
+			owned = [(ordinal, () if key is None else self.cache.names_of(function, key[0])) for ordinal, function, key, position in jobs]
+			tasks = [owned[start::self.workers] for start in range(min(self.workers, len(owned)))]
+			state = node, self.resolution, self.layouts, self.file_name
+			with ProcessPoolExecutor(len(tasks), FORK, initializer=adopt_tree, initargs=state) as pool:
+				for checked, accessed in pool.map(check_functions, tasks):
+					results.update(checked)
+					# Slots of symbols a worker used, the scopes left after checking are the same everywhere
+					for depth, slot in accessed:
+						self._scope[depth].cells[slot].accessed = True
+		emitted = 0
+		for ordinal, function, key, position in jobs:
+			for warning in recorded[emitted:position]:
+				warnings.warn(warning.message)
+			emitted = position
+			result = results[ordinal]
+			if isinstance(result, Exception):
+				raise result
+			messages, accessed = result
+			self.rewarn(messages)
+			if key is not None:
+				self.cache.put(key, FunctionCheck(function, messages, accessed, ()))
+		for warning in recorded[emitted:]:
+			warnings.warn(warning.message)
+		return res
+
+	@contextmanager
+	def held_back(self):
+		# The warnings given inside are kept in self.recorded, where a function checked on its own takes
+		# the ones it gave. Whatever is left there is given once the warnings are back to how they were,
+		# also when checking raised
+		recorded = []
+		try:
+			with warnings.catch_warnings(record=True) as recorded:
+				warnings.simplefilter('always')
+				self.recorded = recorded
+				yield recorded
+		finally:
+			self.recorded = None
+			for warning in recorded:
+				warnings.warn(warning.message)
+
+	def rewarn(self, messages):
+		for message in messages:
+			warnings.warn(message)
+		if messages:
+			self.warnings = True
+
+	def warn_unused(self):
+		unvisited_symbols = self.unvisited_symbols
+		if unvisited_symbols:
+			warnings.warn('Unused variables ({})'.format(','.join(unvisited_symbols)))
+
+	def typed(self, node, value):
+		# Keeps the type of an expression for the code generator to lower it by
+		typ = value.type if isinstance(value, VarSymbol) else value
+		if isinstance(typ, BuiltinTypeSymbol):
+			self.types[node] = typ
+		return value
+
 	def visit_program(self, node):
-		return self.visit(node.block)
+		self.new_scope(self.layouts.get(node, ()))
+		return (yield node.block)
 
 	def visit_if(self, node):
 		blocks = []
 		for x, block in enumerate(node.blocks):
 			self.visit(node.comps[x])
-			blocks.append(self.visit(block))
+			blocks.append((yield block))
 		return blocks
 
 	def visit_else(self, node):
@@ -65,7 +173,7 @@ class Preprocessor(NodeVisitor):
 
 	def visit_while(self, node):
 		self.visit(node.comp)
-		self.visit(node.block)
+		yield node.block
 
 	def visit_for(self, node):
 		for element in node.elements:
@@ -75,18 +183,18 @@ class Preprocessor(NodeVisitor):
 			var_sym = VarSymbol(element.value, elem_type)
 			var_sym.val_assigned = True
 			self.define(var_sym.name, var_sym)
-		self.visit(node.block)
+		yield node.block
 
 	def visit_loopblock(self, node):
 		results = []
 		for child in node.children:
-			results.append(self.visit(child))
+			results.append((yield child))
 		return results
 
 	def visit_switch(self, node):
 		switch_var = self.visit(node.value)
 		for case in node.cases:
-			case_type = self.visit(case)
+			case_type = yield case
 			if case_type != DEFAULT and case_type is not switch_var.type:
 				warnings.warn('file={} line={}: Types in switch do not match case'.format(self.file_name, node.line_num))
 				self.warnings = True
@@ -96,7 +204,7 @@ class Preprocessor(NodeVisitor):
 			case_type = DEFAULT
 		else:
 			case_type = self.visit(node.value)
-		self.visit(node.block)
+		yield node.block
 		return case_type
 
 	def visit_break(self, node):
@@ -107,17 +215,17 @@ class Preprocessor(NodeVisitor):
 
 	def visit_constant(self, node):
 		if node.value == TRUE or node.value == FALSE:
-			return self.search_scopes(BOOL)
+			return self.typed(node, self.search_scopes(BOOL))
 		elif node.value == NAN or node.value == INF or node.value == NEGATIVE_INF:
-			return self.search_scopes(DEC)
+			return self.typed(node, self.search_scopes(DEC))
 		else:
 			return NotImplementedError
 
 	def visit_num(self, node):
-		return self.infer_type(node.value)
+		return self.typed(node, self.infer_type(node.value))
 
 	def visit_str(self, node):
-		return self.infer_type(node.value)
+		return self.typed(node, self.infer_type(node.value))
 
 	def visit_type(self, node):
 		typ = self.search_scopes(node.value)
@@ -150,7 +258,7 @@ class Preprocessor(NodeVisitor):
 			value = self.visit(node.right)
 			if isinstance(value, VarSymbol):
 				value = value.type
-		lookup_var = self.search_scopes(var_name)
+		lookup_var = self.lookup(var_name, self.resolution.get(node.left))
 		if not lookup_var:
 			if collection_type:
 				col_sym = CollectionSymbol(var_name, value, collection_type)
@@ -186,9 +294,8 @@ class Preprocessor(NodeVisitor):
 				warnings.warn('file={} line={}: Cannot change the value of a variable declared constant: {}'.format(self.file_name, var_name, node.line_num))
 				self.warnings = True
 			lookup_var.val_assigned = True
-			if lookup_var.type in (self.search_scopes(DEC), self.search_scopes(FLOAT)):
-				if value in (self.search_scopes(INT), self.search_scopes(DEC), self.search_scopes(FLOAT)):
-					return
+			if BUILTIN_TYPES.widens(lookup_var.type, value):
+				return
 			if lookup_var.type is value:
 				return
 			if lookup_var.type is value.type:
@@ -209,11 +316,8 @@ class Preprocessor(NodeVisitor):
 		right = self.visit(node.right)
 		left_type = self.infer_type(left)
 		right_type = self.infer_type(right)
-		any_type = self.search_scopes(ANY)
-		if left_type in (self.search_scopes(DEC), self.search_scopes(FLOAT)):  # TODO: implicit type conversion needs an expanded official solution
-			if right_type in (self.search_scopes(INT), self.search_scopes(DEC), self.search_scopes(FLOAT)):
-				return left_type
-		if right_type is left_type or left_type is any_type or right_type is any_type:
+		# TODO: implicit type conversion needs an expanded official solution
+		if BUILTIN_TYPES.widens(left_type, right_type) or BUILTIN_TYPES.match(left_type, right_type):
 			return left_type
 		else:
 			warnings.warn('file={} line={}: Things that should not be happening ARE happening (fix this message)'.format(self.file_name, node.line_num))
@@ -225,7 +329,7 @@ class Preprocessor(NodeVisitor):
 
 	def visit_var(self, node):
 		var_name = node.value
-		val = self.search_scopes(var_name)
+		val = self.lookup(var_name, self.resolution.get(node))
 		if val is None:
 			warnings.warn('file={} line={}: Name Error: {}'.format(self.file_name, node.line_num, repr(var_name)))
 			self.warnings = True
@@ -234,40 +338,37 @@ class Preprocessor(NodeVisitor):
 				warnings.warn('file={} line={}: {} is being accessed before it was defined'.format(self.file_name, var_name, node.line_num))
 				self.warnings = True
 			val.accessed = True
-			return val
+			return self.typed(node, val)
 
 	def visit_binop(self, node):
 		if node.op == CAST:
 			self.visit(node.left)
-			return self.infer_type(self.visit(node.right))
+			return self.typed(node, self.infer_type(self.visit(node.right)))
 		else:
 			left = self.visit(node.left)
 			right = self.visit(node.right)
 			left_type = self.infer_type(left)
 			right_type = self.infer_type(right)
-			any_type = self.search_scopes(ANY)
 			# if left_type in self.num_types:
 			# 	if right_type in self.num_types:
 			# 		return left_type
-			if right_type is left_type or left_type is any_type or right_type is any_type:
+			if BUILTIN_TYPES.match(left_type, right_type):
+				# A comparison is checked against the type of its operands, but what it makes is a Bool
+				self.typed(node, self.search_scopes(BOOL) if node.op in COMPARISON_OP else left_type)
 				return left_type
 			else:
 				warnings.warn('file={} line={}: types do not match for operation {}, got {} : {}'.format(self.file_name, node.line_num, node.op, left, right))
 				self.warnings = True
 
 	def visit_unaryop(self, node):
-		return self.visit(node.expr)
+		return self.typed(node, self.visit(node.expr))
 
 	def visit_range(self, node):
 		left = self.visit(node.left)
 		right = self.visit(node.right)
 		left_type = self.infer_type(left)
 		right_type = self.infer_type(right)
-		any_type = self.search_scopes(ANY)
-		if left_type in (self.search_scopes(INT), self.search_scopes(DEC), self.search_scopes(FLOAT)):
-			if right_type in (self.search_scopes(INT), self.search_scopes(DEC), self.search_scopes(FLOAT)):
-				return left_type
-		if right_type is left_type or left_type is any_type or right_type is any_type:
+		if BUILTIN_TYPES.is_arithmetic(left_type) and BUILTIN_TYPES.is_arithmetic(right_type) or BUILTIN_TYPES.match(left_type, right_type):
 			return left_type
 		else:
 			warnings.warn('file={} line={}: Please don\'t do what you just did there ever again. It bad (fix this message)'.format(self.file_name, node.line_num))
@@ -276,7 +377,7 @@ class Preprocessor(NodeVisitor):
 	def visit_compound(self, node):
 		results = []
 		for child in node.children:
-			result = self.visit(child)
+			result = yield child
 			if result:
 				results.append(result)
 		return results
@@ -298,7 +399,64 @@ class Preprocessor(NodeVisitor):
 		if func_type and func_type.name == FUNC:
 			func_type.return_type = self.visit(node.return_type.func_ret_type)
 		self.define(func_name, FuncSymbol(func_name, func_type, node.parameters, node.body, node.parameter_defaults))
-		self.new_scope()
+		ordinal = None
+		if self.ordinal is not None and len(self._scope) == 2:
+			ordinal = self.ordinal
+			self.ordinal += 1
+		if self.owned is not None and ordinal is not None:
+			names = self.owned.get(ordinal)
+			if names is not None:
+				yield from self.owned_function(node, func_type, ordinal, names)
+		elif self.cache is not None:
+			yield from self.cached_function(node, func_type, ordinal)
+		elif ordinal is not None:
+			self.put_aside(node, ordinal, None)
+		else:
+			yield from self.function(node, func_type)
+		self.define(func_name, FuncSymbol(func_name, func_type, node.parameters, node.body, node.parameter_defaults))
+
+	def put_aside(self, node, ordinal, key):
+		self.jobs.append((ordinal, node, key, len(self.recorded)))
+
+	def cached_function(self, node, func_type, ordinal):
+		cache = self.cache
+		key = cache.key(node, self.file_name, self.search_scopes)
+		entry = cache.get(key, node)
+		if entry is not None:
+			self.rewarn(entry.messages)
+			for name in entry.accessed:
+				self.search_scopes(name).accessed = True
+			self.types.update(entry.types(node))
+			return
+		if ordinal is not None:
+			self.put_aside(node, ordinal, key)
+			return
+		messages, accessed = yield from self.function_alone(node, func_type, cache.names_of(node, cache.digest(node)))
+		for message in messages:
+			warnings.warn(message)
+		body = list(walk(node.body))
+		typed = tuple((index, self.types[child]) for index, child in enumerate(body) if child in self.types)
+		cache.put(key, FunctionCheck(node, messages, accessed, typed, [(body[index], typ) for index, typ in typed]))
+
+	def owned_function(self, node, func_type, ordinal, names):
+		self.current = ordinal
+		self.results[ordinal] = yield from self.function_alone(node, func_type, names)
+		self.current = None
+
+	def function_alone(self, node, func_type, names):
+		# Checks the function and takes the warnings it gave back out of self.recorded, returns them and
+		# the names of the outer symbols it was the first to use
+		symbols = [(name, self.search_scopes(name)) for name in names]
+		unused = [(name, symbol) for name, symbol in symbols if getattr(symbol, 'accessed', True) is False]
+		start = len(self.recorded)
+		yield from self.function(node, func_type)
+		caught = self.recorded[start:]
+		del self.recorded[start:]
+		return tuple(str(warning.message) for warning in caught), tuple(name for name, symbol in unused if symbol.accessed)
+
+	def function(self, node, func_type):
+		func_name = node.name
+		self.new_scope(self.layouts.get(node, ()))
 		if node.varargs:
 			varargs_type = self.search_scopes(ARRAY)
 			varargs_type.type = node.varargs[1].value
@@ -319,7 +477,7 @@ class Preprocessor(NodeVisitor):
 				sym = VarSymbol(k, var_type)
 			sym.val_assigned = True
 			self.define(sym.name, sym)
-		return_types = self.visit(node.body)
+		return_types = yield node.body
 		return_types = list(flatten(return_types))
 		if self.return_flag:
 			self.return_flag = False
@@ -331,13 +489,11 @@ class Preprocessor(NodeVisitor):
 		elif func_type != VOID:
 			warnings.warn('file={} line={}: No return value was specified for function: {}'.format(self.file_name, node.line_num, func_name))
 			self.warnings = True
-		func_symbol = FuncSymbol(func_name, func_type, node.parameters, node.body, node.parameter_defaults)
-		self.define(func_name, func_symbol, 1)
 		self.drop_top_scope()
 
 	def visit_anonymousfunc(self, node):
 		func_type = self.search_scopes(node.return_type.value)
-		self.new_scope()
+		self.new_scope(self.layouts.get(node, ()))
 		for k, v in node.parameters.items():
 			var_type = self.search_scopes(v.value)
 			if var_type is self.search_scopes(FUNC):
@@ -347,7 +503,7 @@ class Preprocessor(NodeVisitor):
 			sym.val_assigned = True
 			self.define(sym.name, sym)
 		func_symbol = FuncSymbol(ANON, func_type, node.parameters, node.body)
-		return_var_type = self.visit(func_symbol.body)
+		return_var_type = yield func_symbol.body
 		return_var_type = list(flatten(return_var_type))
 		for ret_type in return_var_type:
 			if self.infer_type(ret_type) is not func_type:
@@ -358,7 +514,7 @@ class Preprocessor(NodeVisitor):
 
 	def visit_funccall(self, node):
 		func_name = node.name
-		func = self.search_scopes(func_name)
+		func = self.lookup(func_name, self.resolution.get(node))
 		for x, param in enumerate(func.parameters.values()):
 			if x < len(node.arguments):
 				var = self.visit(node.arguments[x])
@@ -381,7 +537,7 @@ class Preprocessor(NodeVisitor):
 			self.warnings = True
 		else:
 			func.accessed = True
-			return func.type
+			return self.typed(node, func.type)
 
 	def visit_methodcall(self, node):  # Not done here!
 		method_name = node.name
@@ -441,7 +597,7 @@ class Preprocessor(NodeVisitor):
 	def visit_dotaccess(self, node):
 		obj = self.search_scopes(node.obj)
 		obj.accessed = True
-		return self.visit(obj.type.fields[node.field])
+		return self.typed(node, self.visit(obj.type.fields[node.field]))
 
 	def visit_hashmap(self, node):
 		for key in node.items.keys():
@@ -478,6 +634,41 @@ class Preprocessor(NodeVisitor):
 	def visit_input(self, node):
 		self.visit(node.value)
 
+
+def adopt_tree(tree, resolution, layouts, file_name):
+	# Pool initializer, the workers are forked and get the tree without it being pickled
+	global worker_tree
+	worker_tree = tree, resolution, layouts, file_name
+
+
+def check_functions(owned):
+	# Runs in a worker process. Returns what checking each owned function gave, by its ordinal, and the
+	# slots of the symbols left marked accessed
+	tree, resolution, layouts, file_name = worker_tree
+	checker = Preprocessor(file_name)
+	checker.resolution = resolution
+	checker.layouts = layouts
+	checker.ordinal = 0
+	checker.owned = dict(owned)
+	checker.results = {}
+	# The parent gives the warnings, a worker only hands back those of the functions it owns
+	with warnings.catch_warnings(record=True) as recorded:
+		warnings.simplefilter('always')
+		checker.recorded = recorded
+		try:
+			checker.visit(tree)
+		except Exception as error:
+			if checker.current is None:
+				raise
+			checker.results[checker.current] = error
+			return checker.results, ()
+	accessed = [
+		(depth, slot) for depth, scope in enumerate(checker._scope) for slot, symbol in enumerate(scope.cells)
+		if getattr(symbol, 'accessed', False)
+	]
+	return checker.results, accessed
+
+
 if __name__ == '__main__':
 	from my_lexer import Lexer
 	from my_parser import Parser
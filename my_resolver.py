@@ -0,0 +1,145 @@
+from my_ast import AST, Var, VarDecl, children
+from my_passes import Annotations
+from my_visitor import NodeVisitor
+
+
+class Resolver(NodeVisitor):
+	# Works out where each Var, FuncCall and Assign finds its name: how many scopes out from the innermost
+	# one and which slot of that scope. Scopes are walked in source order, the order the checker and the
+	# code generator define names in, and the layout of every scope is kept on the Program, FuncDecl or
+	# AnonymousFunc that opens it so they can open theirs with the same slots
+	def __init__(self, annotations=None):
+		super().__init__()
+		self.annotations = Annotations() if annotations is None else annotations
+		self.use(self.annotations)
+
+	def resolve_tree(self, tree):
+		self.visit(tree)
+		return self.annotations
+
+	def bind(self, name, node=None):
+		# Assignments define their name in the innermost scope, whether or not an outer one has it
+		self.define(name, name)
+		if node is not None:
+			self.resolution[node] = (0, self.top_scope.slot(name))
+
+	def reference(self, node, name):
+		where = self.resolve(name)
+		if where is not None:
+			self.resolution[node] = where
+
+	def generic_visit(self, node):
+		for child in children(node):
+			yield child
+
+	@staticmethod
+	def visit_leaf(node):
+		pass
+
+	visit_num = visit_str = visit_constant = visit_type = visit_void = visit_leaf
+	visit_else = visit_break = visit_continue = visit_pass = visit_leaf
+
+	def visit_compound(self, node):
+		for child in node.children:
+			yield child
+
+	visit_loopblock = visit_compound
+
+	# Expressions are only as deep as a line is long, they are visited without a generator
+	def expression(self, value):
+		if isinstance(value, AST):
+			self.visit(value)
+
+	def visit_binop(self, node):
+		self.expression(node.left)
+		self.expression(node.right)
+
+	visit_range = visit_binop
+
+	def visit_unaryop(self, node):
+		self.expression(node.expr)
+
+	def visit_return(self, node):
+		self.expression(node.value)
+
+	visit_print = visit_return
+
+	def visit_program(self, node):
+		self.new_scope()
+		yield node.block
+		self.layouts[node] = tuple(self.top_scope.names)
+
+	def visit_var(self, node):
+		self.reference(node, node.value)
+
+	def visit_funccall(self, node):
+		self.reference(node, node.name)
+		for argument in node.arguments:
+			self.expression(argument)
+		for argument in node.named_arguments.values():
+			self.expression(argument)
+
+	def visit_assign(self, node):
+		self.expression(node.right)
+		left = node.left
+		if isinstance(left, Var):
+			self.reference(left, left.value)
+			self.bind(left.value, node)
+		elif isinstance(left, VarDecl):
+			self.bind(left.value.value, node)
+		else:
+			self.expression(left)
+
+	def visit_vardecl(self, node):
+		self.bind(node.value.value, node)
+
+	def visit_if(self, node):
+		for comp, block in zip(node.comps, node.blocks):
+			yield comp
+			yield block
+
+	def visit_while(self, node):
+		yield node.comp
+		yield node.block
+
+	def visit_for(self, node):
+		yield node.iterator
+		for element in node.elements:
+			self.bind(element.value, element)
+		yield node.block
+
+	def visit_switch(self, node):
+		yield node.value
+		for case in node.cases:
+			yield case
+
+	def visit_case(self, node):
+		if isinstance(node.value, AST):
+			yield node.value
+		yield node.block
+
+	def visit_structdeclaration(self, node):
+		self.bind(node.name)
+
+	def visit_aliasdeclaration(self, node):
+		self.bind(node.name)
+
+	def visit_funcdecl(self, node):
+		self.bind(node.name)
+		yield from self.function(node)
+
+	def visit_anonymousfunc(self, node):
+		yield from self.function(node)
+
+	def function(self, node):
+		self.new_scope()
+		if node.varargs:
+			self.bind(node.varargs[0])
+		for name in node.parameters:
+			self.bind(name)
+		yield node.body
+		self.layouts[node] = tuple(self.drop_top_scope().names)
+
+
+def resolve(tree, annotations=None):
+	return Resolver(annotations).resolve_tree(tree)
@@ -1,126 +1,84 @@
-from collections import OrderedDict
-from decimal import Decimal
-from enum import Enum
-from my_ast import Type
-from my_visitor import BuiltinFuncSymbol
-from my_types import *
+from collections.abc import MutableMapping
+from sys import intern
 
+# Annotation tables filled in by the resolver
+RESOLUTION = 'resolution'
+LAYOUT = 'layout'
+# and by the checker
+EXPRESSION_TYPE = 'type'
 
-class Symbol(object):
-	def __init__(self, name, symbol_type=None):
-		self.name = name
-		self.type = symbol_type
 
+class Undefined(object):
+	def __repr__(self):
+		return 'UNDEFINED'
 
-class BuiltinTypeSymbol(Symbol):
-	def __init__(self, name):
-		super().__init__(name)
 
-	def __str__(self):
-		return self.name
-
-	__repr__ = __str__
+UNDEFINED = Undefined()
 
 
-ANY_BUILTIN = BuiltinTypeSymbol(ANY)
-INT_BUILTIN = BuiltinTypeSymbol(INT)
-DEC_BUILTIN = BuiltinTypeSymbol(DEC)
-FLOAT_BUILTIN = BuiltinTypeSymbol(FLOAT)
-COMPLEX_BUILTIN = BuiltinTypeSymbol(COMPLEX)
-BOOL_BUILTIN = BuiltinTypeSymbol(BOOL)
-BYTES_BUILTIN = BuiltinTypeSymbol(BYTES)
-STR_BUILTIN = BuiltinTypeSymbol(STR)
-ARRAY_BUILTIN = BuiltinTypeSymbol(ARRAY)
-LIST_BUILTIN = BuiltinTypeSymbol(LIST)
-DICT_BUILTIN = BuiltinTypeSymbol(DICT)
-ENUM_BUILTIN = BuiltinTypeSymbol(ENUM)
-FUNC_BUILTIN = BuiltinTypeSymbol(FUNC)
-
-
-class VarSymbol(Symbol):
-	def __init__(self, name, var_type, read_only=False):
-		super().__init__(name, var_type)
-		self.accessed = False
-		self.val_assigned = False
-		self.read_only = read_only
-
-	def __str__(self):
-		return '<{name}:{type}>'.format(name=self.name, type=self.type)
+class Scope(MutableMapping):
+	# Each name gets a slot, in the order of the layout it was made with and after that in the order names
+	# are defined. A slot can be laid out and not defined yet, the name is not in the scope until it is
+	__slots__ = ('slots', 'names', 'cells')
 
-	__repr__ = __str__
+	def __init__(self, layout=()):
+		self.names = list(layout)
+		self.slots = {name: slot for slot, name in enumerate(self.names)}
+		self.cells = [UNDEFINED] * len(self.names)
 
+	def slot(self, name):
+		slot = self.slots.get(name)
+		if slot is None:
+			slot = self.slots[name] = len(self.names)
+			self.names.append(name)
+			self.cells.append(UNDEFINED)
+		return slot
 
-class CollectionSymbol(Symbol):
-	def __init__(self, name, var_type, item_types):
-		super().__init__(name, var_type)
-		self.item_types = item_types
-		self.accessed = False
-		self.val_assigned = False
+	def get(self, name, default=None, slot=None):
+		# slot is where the resolver expects name to be, it is only trusted when the name there matches
+		if slot is None or slot >= len(self.names) or self.names[slot] != name:
+			slot = self.slots.get(name)
+			if slot is None:
+				return default
+		value = self.cells[slot]
+		return default if value is UNDEFINED else value
 
+	def __getitem__(self, name):
+		value = self.get(name, UNDEFINED)
+		if value is UNDEFINED:
+			raise KeyError(name)
+		return value
 
-class FuncSymbol(Symbol):
-	def __init__(self, name, return_type, parameters, body):
-		super().__init__(name, return_type)
-		self.parameters = parameters
-		self.body = body
-		self.accessed = False
-		self.val_assigned = True
+	def __setitem__(self, name, value):
+		self.cells[self.slot(name)] = value
 
-	def __str__(self):
-		return '<{name}:{type} ({params})>'.format(name=self.name, type=self.type, params=', '.join('{}:{}'.format(key, value.value) for key, value in self.parameters.items()))
+	def __delitem__(self, name):
+		slot = self.slots.get(name)
+		if slot is None or self.cells[slot] is UNDEFINED:
+			raise KeyError(name)
+		self.cells[slot] = UNDEFINED
 
-	__repr__ = __str__
+	def __iter__(self):
+		for name, value in zip(self.names, self.cells):
+			if value is not UNDEFINED:
+				yield name
 
+	def __len__(self):
+		return sum(1 for value in self.cells if value is not UNDEFINED)
 
-class TypeSymbol(Symbol):
-	def __init__(self, name, types):
-		super().__init__(name, types)
-		self.accessed = False
-
-	def __str__(self):
-		return '<{name}:{type}>'.format(name=self.name, type=self.type)
-
-	__repr__ = __str__
+	def __repr__(self):
+		return repr(dict(self.items()))
 
 
 class SymbolTable(object):
 	def __init__(self):
-		self._scope = [OrderedDict()]
-		self._init_builtins()
-
-	def _init_builtins(self):
-		self.define(ANY_BUILTIN)
-		self.define(INT_BUILTIN)
-		self.define(DEC_BUILTIN)
-		self.define(FLOAT_BUILTIN)
-		self.define(COMPLEX_BUILTIN)
-		self.define(BOOL_BUILTIN)
-		self.define(BYTES_BUILTIN)
-		self.define(STR_BUILTIN)
-		self.define(ARRAY_BUILTIN)
-		self.define(LIST_BUILTIN)
-		self.define(DICT_BUILTIN)
-		self.define(ENUM_BUILTIN)
-		self.define(FUNC_BUILTIN)
+		self._scope = [Scope()]
 
 	def __str__(self):
-		s = 'Symbols: {}'.format(self.symbols)
-		return s
+		return 'Symbols: {}'.format(self.symbols)
 
 	__repr__ = __str__
 
-	@property
-	def symbols(self):
-		return [value for scope in self._scope for value in scope.values()]
-
-	@property
-	def keys(self):
-		return [key for scope in self._scope for key in scope.keys()]
-
-	@property
-	def items(self):
-		return [(key, value) for scope in self._scope for key, value in scope.items()]
-
 	@property
 	def top_scope(self):
 		return self._scope[-1] if len(self._scope) >= 1 else None
@@ -129,59 +87,58 @@ class SymbolTable(object):
 	def second_scope(self):
 		return self._scope[-2] if len(self._scope) >= 2 else None
 
-	def search_scopes(self, name):
+	def search_scopes(self, name, level=None):
+		if level:
+			return self._scope[level].get(name)
+		for scope in reversed(self._scope):
+			slot = scope.slots.get(name)
+			if slot is not None:
+				value = scope.cells[slot]
+				if value is not UNDEFINED:
+					return value
+
+	def resolve(self, name):
+		# (depth, slot) of the innermost definition of name, depth counting scopes out from the top one
+		depth = 0
 		for scope in reversed(self._scope):
-			if name in scope:
-				return scope[name]
+			slot = scope.slots.get(name)
+			if slot is not None and scope.cells[slot] is not UNDEFINED:
+				return depth, slot
+			depth += 1
+
+	def lookup(self, name, where=None):
+		# where is the (depth, slot) the resolver found for name. The scope at that depth is read directly,
+		# the scopes are only searched when name is not there yet
+		if where is not None:
+			depth, slot = where
+			try:
+				scope = self._scope[~depth]
+				if scope.names[slot] == name:
+					value = scope.cells[slot]
+					if value is not UNDEFINED:
+						return value
+			except IndexError:
+				pass
+		return self.search_scopes(name)
+
+	def define(self, key, value, level=0):
+		level = (len(self._scope) - level) - 1
+		self._scope[level][intern(key)] = value
 
-	def new_scope(self):
-		self._scope.append(OrderedDict())
+	def new_scope(self, layout=()):
+		self._scope.append(Scope(layout))
 
 	def drop_top_scope(self):
-		self._scope.pop()
+		return self._scope.pop()
 
 	@property
-	def unvisited_symbols(self):
-		return [sym_name for sym_name, sym_val in self.items if not isinstance(sym_val, (BuiltinTypeSymbol, BuiltinFuncSymbol)) and not sym_val.accessed]
-
-	def define(self, symbol, level=0):
-		level = (len(self._scope) - level) - 1
-		self._scope[level][symbol.name] = symbol
+	def symbols(self):
+		return [value for scope in self._scope for value in scope.values()]
 
-	def lookup(self, name):
-		return self.search_scopes(name)
+	@property
+	def keys(self):
+		return [key for scope in self._scope for key in scope]
 
-	# def infer_type(self, value):
-	# 	if isinstance(value, BuiltinTypeSymbol):
-	# 		return value
-	# 	if isinstance(value, FuncSymbol):
-	# 		return self.lookup(FUNC)
-	# 	elif isinstance(value, VarSymbol):
-	# 		return value.type
-	# 	elif isinstance(value, Type):
-	# 		return self.lookup(value.value)
-	# 	else:
-	# 		if isinstance(value, int):
-	# 			return self.lookup(INT)
-	# 		elif isinstance(value, Decimal):
-	# 			return self.lookup(DEC)
-	# 		elif isinstance(value, float):
-	# 			return self.lookup(FLOAT)
-	# 		elif isinstance(value, complex):
-	# 			return self.lookup(COMPLEX)
-	# 		elif isinstance(value, str):
-	# 			return self.lookup(STR)
-	# 		elif isinstance(value, bool):
-	# 			return self.lookup(BOOL)
-	# 		elif isinstance(value, bytes):
-	# 			return self.lookup(BYTES)
-	# 		elif isinstance(value, list):
-	# 			return self.lookup(LIST)
-	# 		elif isinstance(value, dict):
-	# 			return self.lookup(DICT)
-	# 		elif isinstance(value, Enum):
-	# 			return self.lookup(ENUM)
-	# 		elif callable(value):
-	# 			return self.lookup(FUNC)
-	# 		else:
-	# 			raise TypeError('Type not recognized: {}'.format(value))
+	@property
+	def items(self):
+		return [(key, value) for scope in self._scope for key, value in scope.items()]
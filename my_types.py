@@ -6,6 +6,10 @@ class Any:
 	def __init__(self):
 		self.name = ANY
 
+	@staticmethod
+	def type():
+		return ir.VoidType()
+
 	def __str__(self):
 		return '<{}>'.format(self.name)
 
@@ -210,6 +214,105 @@ class Func(AnyRef):
 		return ir.FunctionType
 
 
+# Integer types narrowest first, then the floating point ones. Two of them combine into the later one
+PROMOTION_ORDER = (BOOL, INT8, INT32, INT, INT64, INT128, FLOAT, DEC)
+INTEGER_TYPES = (BOOL, INT8, INT32, INT, INT64, INT128)
+REAL_TYPES = (FLOAT, DEC)
+# The types the checker lets stand in for one another, a variable of a real type takes any of them
+ARITHMETIC_TYPES = (INT, DEC, FLOAT)
+WIDENING = {DEC: ARITHMETIC_TYPES, FLOAT: ARITHMETIC_TYPES}
+
+
+class TypeRegistry(object):
+	# One instance of every type, each with a code. How two types relate is worked out once for every pair
+	# and looked up by their codes, anything that is not a builtin type shares the last code
+	def __init__(self, classes):
+		self.types = []
+		self.by_name = {}
+		for cls in classes:
+			typ = cls()
+			typ.code = len(self.types)
+			self.types.append(typ)
+			self.by_name[typ.name] = typ
+		self.other = len(self.types)
+		self.llvm_types = [self.to_llvm(typ) for typ in self.types] + [None]
+		self.by_llvm = {}
+		for typ in reversed(self.types):
+			llvm_type = self.llvm_types[typ.code]
+			if isinstance(llvm_type, ir.Type):
+				self.by_llvm[self.llvm_key(llvm_type)] = typ
+		names = [typ.name for typ in self.types] + [None]
+		self.promotions = tuple(tuple(self.promotion(left, right) for right in names) for left in names)
+		self.widenings = tuple(tuple(right in WIDENING.get(left, ()) for right in names) for left in names)
+		self.matches = tuple(tuple(left is not None and (left == right or ANY in (left, right)) for right in names) for left in names)
+		self.arithmetic = tuple(name in ARITHMETIC_TYPES for name in names)
+		self.integers = tuple(name in INTEGER_TYPES for name in names)
+		self.reals = tuple(name in REAL_TYPES for name in names)
+
+	def __getitem__(self, name):
+		return self.by_name[name]
+
+	def code(self, typ):
+		# Builtin type symbols carry the code of their type
+		return getattr(typ, 'code', self.other)
+
+	def code_of(self, name):
+		typ = self.by_name.get(name)
+		return self.other if typ is None else typ.code
+
+	@staticmethod
+	def to_llvm(typ):
+		try:
+			return typ.type()
+		except (NotImplementedError, TypeError):
+			return None
+
+	@staticmethod
+	def llvm_key(llvm_type):
+		return type(llvm_type), getattr(llvm_type, 'width', None)
+
+	def llvm(self, typ):
+		return self.llvm_types[self.code(typ)]
+
+	def from_llvm(self, llvm_type):
+		return self.by_llvm.get(self.llvm_key(llvm_type))
+
+	def promotion(self, left, right):
+		if left is None or right is None:
+			return None
+		if left == right:
+			return self.by_name[left]
+		if left in PROMOTION_ORDER and right in PROMOTION_ORDER:
+			return self.by_name[max(left, right, key=PROMOTION_ORDER.index)]
+
+	def promote(self, left, right):
+		# The type an operation on the two is done in, None when they do not mix
+		return self.promotions[self.code(left)][self.code(right)]
+
+	def widens(self, target, value):
+		# Whether a variable of type target takes a value of type value other than its own
+		return self.widenings[self.code(target)][self.code(value)]
+
+	def match(self, left, right):
+		return left is right or self.matches[self.code(left)][self.code(right)]
+
+	def is_arithmetic(self, typ):
+		return self.arithmetic[self.code(typ)]
+
+	def is_integer(self, typ):
+		return self.integers[self.code(typ)]
+
+	def is_real(self, typ):
+		return self.reals[self.code(typ)]
+
+	def is_known(self, typ):
+		# Any builtin type but Any itself
+		code = self.code(typ)
+		return code != self.other and self.types[code].name != ANY
+
+
+BUILTIN_TYPES = TypeRegistry((Any, Int, Int8, Int32, Int64, Int128, Dec, Float, Complex, Str, Bool, Bytes, Array, List, Set, Dict, Enum, Struct, Func))
+
 # def get_type_cls(cls):
 # 	import sys
 # 	import inspect
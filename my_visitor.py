@@ -1,6 +1,9 @@
 from decimal import Decimal
 from enum import Enum
-from my_ast import Type
+from inspect import getattr_static
+from types import GeneratorType
+from my_ast import AST, Type
+from my_symbol_table import EXPRESSION_TYPE, LAYOUT, RESOLUTION, SymbolTable
 from my_types import *
 
 
@@ -15,6 +18,7 @@ class BuiltinTypeSymbol(Symbol):
 		super().__init__(name)
 		self.llvm_type = llvm_type
 		self.return_type = return_type
+		self.code = BUILTIN_TYPES.code_of(name)
 
 	def type(self):
 		return self.llvm_type.type()
@@ -113,11 +117,40 @@ class BuiltinFuncSymbol(Symbol):
 	__repr__ = __str__
 
 
-class NodeVisitor(object):
+class NodeVisitor(SymbolTable):
+	_dispatch = {}
+
 	def __init__(self):
-		self._scope = [{}]
+		super().__init__()
+		self.resolution = {}
+		self.layouts = {}
+		self.types = {}
 		self._init_builtins()
 
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls._hooked = cls.enter is not NodeVisitor.enter or cls.leave is not NodeVisitor.leave
+		# node type -> function taking (visitor, node), so visit does one dict lookup per node
+		cls._dispatch = {}
+		node_types = [AST]
+		while node_types:
+			node_type = node_types.pop()
+			node_types.extend(node_type.__subclasses__())
+			cls.dispatcher(node_type)
+
+	@classmethod
+	def dispatcher(cls, node_type):
+		method = getattr_static(cls, 'visit_' + node_type.__name__.lower(), None)
+		if method is None:
+			method = getattr_static(cls, 'generic_visit')
+		if isinstance(method, staticmethod):
+			function = method.__func__
+
+			def method(visitor, node):
+				return function(node)
+		cls._dispatch[node_type] = method
+		return method
+
 	def _init_builtins(self):
 		self.define(ANY, ANY_BUILTIN)
 		self.define(INT, INT_BUILTIN)
@@ -137,58 +170,89 @@ class NodeVisitor(object):
 		self.define(ENUM, ENUM_BUILTIN)
 		self.define(FUNC, FUNC_BUILTIN)
 
+	def enter(self, node):
+		pass
+
+	def leave(self, node, result):
+		return result
+
 	def visit(self, node):
-		method_name = 'visit_' + type(node).__name__.lower()
-		visitor = getattr(self, method_name, self.generic_visit)
-		return visitor(node)
+		# A visit_* method may be a generator that yields the nodes it wants visited and is sent back
+		# their results. Those are run off the stack below instead of the Python call stack, which is
+		# what lets deeply nested blocks through. enter and leave are called around every node visited
+		hooked = self._hooked
+		dispatch = self._dispatch
+		if hooked:
+			self.enter(node)
+		visitor = dispatch.get(type(node)) or self.dispatcher(type(node))
+		result = visitor(self, node)
+		if type(result) is not GeneratorType:
+			return self.leave(node, result) if hooked else result
+		stack = [(node, result)]
+		result = None
+		error = None
+		while stack:
+			try:
+				if error is None:
+					child = stack[-1][1].send(result)
+				else:
+					# Raised while visiting the child, the generator gets it at its yield as it would from a call
+					exc, error = error, None
+					child = stack[-1][1].throw(exc)
+			except StopIteration as stop:
+				result = stop.value
+				node = stack.pop()[0]
+				if hooked:
+					try:
+						result = self.leave(node, result)
+					except BaseException as exc:
+						if not stack:
+							raise
+						error = exc
+				continue
+			except BaseException as exc:
+				# The generator let it through and is done, the one below it gets it next
+				stack.pop()
+				if not stack:
+					raise
+				error = exc
+				continue
+			try:
+				if hooked:
+					self.enter(child)
+				visitor = dispatch.get(type(child)) or self.dispatcher(type(child))
+				result = visitor(self, child)
+				if type(result) is GeneratorType:
+					stack.append((child, result))
+					result = None
+				elif hooked:
+					result = self.leave(child, result)
+			except BaseException as exc:
+				error = exc
+		return result
 
 	@staticmethod
 	def generic_visit(node):
 		raise Exception('No visit_{} method'.format(type(node).__name__.lower()))
 
-	@property
-	def top_scope(self):
-		return self._scope[-1] if len(self._scope) >= 1 else None
-
-	@property
-	def second_scope(self):
-		return self._scope[-2] if len(self._scope) >= 2 else None
-
-	def search_scopes(self, name, level=None):
-		if level:
-			if name in self._scope[level]:
-				return self._scope[level][name]
-		else:
-			for scope in reversed(self._scope):
-				if name in scope:
-					return scope[name]
-
-	def define(self, key, value, level=0):
-		level = (len(self._scope) - level) - 1
-		self._scope[level][key] = value
-
-	def new_scope(self):
-		self._scope.append({})
-
-	def drop_top_scope(self):
-		self._scope.pop()
-
-	@property
-	def symbols(self):
-		return [value for scope in self._scope for value in scope.values()]
-
-	@property
-	def keys(self):
-		return [key for scope in self._scope for key in scope.keys()]
-
-	@property
-	def items(self):
-		return [(key, value) for scope in self._scope for key, value in scope.items()]
-
 	@property
 	def unvisited_symbols(self):
-		return [sym_name for sym_name, sym_val in self.items if
-			not isinstance(sym_val, (BuiltinTypeSymbol, BuiltinFuncSymbol)) and not sym_val.accessed]
+		return [
+			sym_name for scope in self._scope for sym_name, sym_val in scope.items()
+			if not isinstance(sym_val, (BuiltinTypeSymbol, BuiltinFuncSymbol)) and not sym_val.accessed
+		]
+
+	def use(self, annotations):
+		# Name lookups go straight to the slots the resolver worked out for this tree
+		self.resolution = annotations.table(RESOLUTION)
+		self.layouts = annotations.table(LAYOUT)
+		self.types = annotations.table(EXPRESSION_TYPE)
+
+	def slot_of(self, node):
+		# The slot node binds in the top scope, None when the resolver has nothing for it
+		where = self.resolution.get(node)
+		if where is not None and where[0] == 0:
+			return where[1]
 
 	def infer_type(self, value):
 		if isinstance(value, BuiltinTypeSymbol):
@@ -224,3 +288,30 @@ class NodeVisitor(object):
 				return self.search_scopes(FUNC)
 			else:
 				raise TypeError('Type not recognized: {}'.format(value))
+
+
+if __name__ == '__main__':
+	from timeit import timeit
+	from my_ast import walk
+	from my_lexer import Lexer
+	from my_parser import Parser
+	from my_preprocessor import Preprocessor
+	from my_interpreter import Interpreter
+	from compiler.my_compiler import CodeGenerator
+	nodes = list(walk(Parser(Lexer(open('test.my').read())).parse())) * 1000
+
+	def by_name(visitor):
+		for node in nodes:
+			getattr(visitor, 'visit_' + type(node).__name__.lower(), visitor.generic_visit)
+
+	def by_table(visitor):
+		dispatch = visitor._dispatch
+		for node in nodes:
+			dispatch.get(type(node)) or visitor.dispatcher(type(node))
+
+	for visitor_class in (Preprocessor, CodeGenerator, Interpreter):
+		# only dispatch is timed, so the visitors are left uninitialised
+		visitor = visitor_class.__new__(visitor_class)
+		for dispatch in (by_name, by_table):
+			seconds = timeit(lambda: dispatch(visitor), number=20)
+			print('{:<14} {:<9} {:.0f} ns/node'.format(visitor_class.__name__, dispatch.__name__, seconds / 20 / len(nodes) * 1e9))